@@ -0,0 +1,131 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+
+    Times reading and writing synthetic blueprints and appends the results
+    to a JSON file, so runs can be compared across commits.
+
+    Usage: python -m benchmarks.run [--scale N] [--repeat N] [--output FILE]
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from devtools.blueprint_files import Header, Meta
+from devtools.synthetic import count_tags, synthetic_header, synthetic_meta
+
+
+def measure(function, repeat):
+    """Best wall time of `repeat` calls and peak traced memory of one call."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def cases(path, scale):
+    """Yield (name, function, bytes, tags) of all benchmark cases."""
+    header = synthetic_header(min(60000, 2000 * scale))
+    header_file = os.path.join(path, 'header.smbph')
+    header.to_file(header_file)
+    size = os.path.getsize(header_file)
+    yield 'Header.from_file', lambda: Header.from_file(header_file), size, 0
+    yield 'Header.from_file buffered', \
+        lambda: Header.from_file(header_file, buffered=True), size, 0
+    yield 'Header.from_file histogram', \
+        lambda: Header.from_file(header_file, histogram=True), size, 0
+    yield 'Header.to_file', lambda: header.to_file(header_file), size, 0
+
+    metas = [('deep', synthetic_meta(depth=6 + scale, breadth=6, n_docked=10 * scale)),
+             ('wide', synthetic_meta(depth=2, breadth=40 * scale, list_length=64)),
+             ('bytearrays', synthetic_meta(depth=3, breadth=8 * scale,
+                                           bytearray_size=50000)),
+             ('compressed', synthetic_meta(depth=4, breadth=6 * scale, compressed=True))]
+    for name, meta in metas:
+        meta_file = os.path.join(path, '{}.smbpm'.format(name))
+        meta.to_file(meta_file)
+        size = os.path.getsize(meta_file)
+        tags = count_tags(meta.tags.tag) + len(meta.docked)
+        yield 'Meta.from_file {}'.format(name), \
+            lambda f=meta_file: Meta.from_file(f), size, tags
+        yield 'Meta.from_file {} buffered'.format(name), \
+            lambda f=meta_file: Meta.from_file(f, buffered=True), size, tags
+        yield 'Meta.to_file {}'.format(name), \
+            lambda m=meta, f=meta_file: m.to_file(f), size, tags
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Blueprint parser and writer benchmarks')
+    parser.add_argument('--scale', type=int, default=4, help='Size of the synthetic files')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_results.json',
+                        help='JSON file the results are appended to')
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    results = []
+    try:
+        print('{:<36} {:>10} {:>10} {:>12} {:>10}'.format(
+            'case', 'ms', 'MB/s', 'tags/s', 'peak KiB'))
+        for name, function, size, tags in cases(path, args.scale):
+            seconds, peak = measure(function, args.repeat)
+            result = {'case': name, 'seconds': seconds, 'bytes': size, 'tags': tags,
+                      'mb_per_s': size / seconds / 1e6,
+                      'tags_per_s': tags / seconds if tags else None,
+                      'peak_memory': peak}
+            results.append(result)
+            print('{:<36} {:>10.2f} {:>10.1f} {:>12} {:>10.0f}'.format(
+                name, seconds * 1e3, result['mb_per_s'],
+                '{:.0f}'.format(result['tags_per_s']) if tags else '-', peak / 1024))
+    finally:
+        shutil.rmtree(path)
+
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as file:
+            runs = json.load(file)
+    runs.append({'commit': git_commit(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': sys.version.split()[0],
+                 'platform': platform.platform(),
+                 'scale': args.scale,
+                 'results': results})
+    with open(args.output, 'w') as file:
+        json.dump(runs, file, indent=1)
@@ -0,0 +1,59 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+
+    Measures how segment loading throughput scales with the number of
+    worker threads on a synthetic station blueprint.
+
+    Usage: python -m benchmarks.segment_threads [--regions N] [--workers 1 2 4 8]
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from devtools.blueprint_files import Segment, load_segments
+from devtools.synthetic import synthetic_station
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Segment loading thread scaling benchmark')
+    parser.add_argument('--regions', type=int, default=4)
+    parser.add_argument('--segments', type=int, default=256,
+                        help='segments per region file')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        blueprint = os.path.join(path, 'station')
+        synthetic_station(blueprint, args.regions, args.segments)
+        n = args.regions * args.segments
+        inflated = n * Segment.n_blocks * 3 / 1e6
+        print('{} segments, {:.1f} MB inflated, {} cpus'.format(n, inflated, os.cpu_count()))
+        print('workers  ordered   segments/s      MB/s')
+        for workers in args.workers:
+            for ordered in [True, False]:
+                start = time.perf_counter()
+                for _ in load_segments(blueprint, workers=workers, ordered=ordered):
+                    pass
+                elapsed = time.perf_counter() - start
+                print('{:>7} {:>8} {:>12.0f} {:>9.1f}'.format(
+                    workers, str(ordered), n / elapsed, inflated / elapsed))
+    finally:
+        shutil.rmtree(path)
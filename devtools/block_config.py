@@ -20,15 +20,118 @@
     <https://starmadepedia.net/wiki/Blueprint_File_Formats> (June 4, 2015).
 """
 
-from collections import deque, namedtuple
+import hashlib
+import os
+import pickle
+import sys
+from bisect import bisect_left
+from collections import namedtuple
 import xml.etree.ElementTree as ET
 
+from devtools.blueprint_files import write_atomic
+
 
 Block = namedtuple('Block', ['name', 'category'])
 
+# Value of a nested or attributed element in `BlockConfig.attributes`.
+# `children` is a tuple of (tag, value) pairs.
+Property = namedtuple('Property', ['attrib', 'text', 'children'])
+
+
+def _element_value(elem):
+    text = sys.intern((elem.text or '').strip())
+    if not len(elem) and not elem.attrib:
+        return text
+    return Property({sys.intern(k): sys.intern(v) for k, v in elem.attrib.items()},
+                    text,
+                    tuple((sys.intern(child.tag), _element_value(child)) for child in elem))
+
 
 class BlockConfig(object):
-    def __init__(self, idmapfile='BlockTypes.properties', blockcfgfile='BlockConfig.xml'):
+    """Block names, categories and properties by block id.
+
+    Parameters
+    ----------
+    idmapfile: path to BlockTypes.properties
+    blockcfgfile: path to BlockConfig.xml
+    cachedir: directory for a compiled cache of the parsed files. The cache
+              is keyed by the files' paths, sizes and modification times
+              and rebuilt when either file changes.
+
+    Attributes
+    ----------
+    blocks: dict of block id -> `Block`
+    attributes: dict of block id -> dict of all XML attributes and child
+                elements of the block. Plain elements map to their text,
+                others to a `Property`.
+    """
+    cache_version = 2
+
+    def __init__(self, idmapfile='BlockTypes.properties', blockcfgfile='BlockConfig.xml',
+                 cachedir=None):
+        if cachedir is None:
+            self.blocks, self.attributes = BlockConfig.parse(idmapfile, blockcfgfile)
+        else:
+            self.blocks, self.attributes = BlockConfig._load_cached(
+                idmapfile, blockcfgfile, cachedir)
+
+        self.ids_by_name = {block.name: id for id, block in self.blocks.items()}
+        self._categories = sorted((block.category, id) for id, block in self.blocks.items())
+
+    def by_name(self, name):
+        return self.blocks[self.ids_by_name[name]]
+
+    def in_category(self, category):
+        """Ids of all blocks in `category` or its sub-categories.
+
+        `in_category('Blocks.Ship.Weapons')` includes 'Blocks.Ship.Weapons.Missile'
+        but not 'Blocks.Ship.WeaponsExtra'.
+        """
+        categories = self._categories
+        result = []
+        for i in range(bisect_left(categories, (category,)), len(categories)):
+            c, id = categories[i]
+            if c != category and not c.startswith(category + '.'):
+                if not c.startswith(category):
+                    break
+                continue
+            result.append(id)
+        return result
+
+    @staticmethod
+    def _load_cached(idmapfile, blockcfgfile, cachedir):
+        sources = [os.path.abspath(f) for f in (idmapfile, blockcfgfile)]
+        key = [BlockConfig.cache_version]
+        for filename in sources:
+            stat = os.stat(filename)
+            key.append((filename, stat.st_size, stat.st_mtime_ns))
+        cachefile = os.path.join(cachedir, 'blockconfig-{}.pickle'.format(
+            hashlib.sha1('\0'.join(sources).encode('utf-8')).hexdigest()))
+
+        try:
+            with open(cachefile, 'rb') as file:
+                cached_key, parsed = pickle.load(file)
+            if cached_key == key:
+                return parsed
+        except Exception:
+            pass
+
+        parsed = BlockConfig.parse(idmapfile, blockcfgfile)
+        # the cache is only an optimization, don't fail if it can't be written
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            write_atomic(cachefile, pickle.dumps((key, parsed), pickle.HIGHEST_PROTOCOL))
+        except OSError:
+            pass
+        return parsed
+
+    @staticmethod
+    def parse(idmapfile, blockcfgfile):
+        """Parse the config files into (blocks, attributes) dicts.
+
+        BlockConfig.xml is read with `iterparse`; each block's elements are
+        discarded as soon as the block is converted.
+        """
         idmap = {}
         for line in open(idmapfile):
             ids = [l.strip() for l in line.split('=')]
@@ -36,21 +139,34 @@ class BlockConfig(object):
                 continue
             idmap[ids[0]] = int(ids[1])
 
-        xmltree = ET.parse(blockcfgfile)
-        root = xmltree.getroot()
-
-        queue = deque([('Blocks', i) for i in root.find('Element')])
-
-        self.blocks = {}
-        while queue:
-            category, item = queue.popleft()
-            if item.tag != 'Block':
-                category += '.' + item.tag
-                for child in item:
-                    queue.append((category, child))
+        blocks = {}
+        attributes = {}
+        path = []
+        parents = []
+        block = None
+        for event, elem in ET.iterparse(blockcfgfile, events=('start', 'end')):
+            if block is not None:
+                if elem is not block:
+                    continue
+                id = idmap[elem.attrib['type']]
+                blocks[id] = Block(name=elem.attrib['name'],
+                                   category='.'.join(['Blocks'] + path[2:]))
+                attrs = {sys.intern(k): sys.intern(v) for k, v in elem.attrib.items()}
+                for child in elem:
+                    attrs[sys.intern(child.tag)] = _element_value(child)
+                attributes[id] = attrs
+                parents[-1].remove(elem)
+                block = None
+            elif event == 'start':
+                if elem.tag == 'Block' and path[1:2] == ['Element']:
+                    block = elem
+                else:
+                    path.append(elem.tag)
+                    parents.append(elem)
             else:
-                id = idmap[item.attrib['type']]
-                self.blocks[id] = Block(name=item.attrib['name'],
-                                        category=category)
+                path.pop()
+                parents.pop()
+                elem.clear()
+        return blocks, attributes
 
 #BlockConfig('../data/BlockTypes.properties', '../data/BlockConfig.xml')
\ No newline at end of file
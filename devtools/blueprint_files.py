@@ -16,9 +16,25 @@
     Copyright 2015, Martin Billinger
 """
 
+import asyncio
+import io
+import mmap
+import os
 import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from glob import glob
+from itertools import islice
+from time import perf_counter
 from enum import Enum
 
+from devtools.histogram import ElementHistogram
+
 
 class EntityTypes(Enum):
     ship = 0
@@ -37,6 +53,7 @@ class TagTypes(Enum):
 class BinFileParser(object):
     def __init__(self, file):
         self.file = file
+        self.codecs = Payload.codecs
 
     def get(self, decoder):
         """
@@ -60,8 +77,279 @@ class BinFileParser(object):
             decoder = struct.Struct(decoder)
         return decoder.unpack(self.file.read(decoder.size))[0]
 
+    def get_bytes(self, size):
+        data = self.file.read(size)
+        if len(data) != size:
+            raise struct.error('unpack requires a buffer of {} bytes'.format(size))
+        return data
+
+    def skip(self, size):
+        """Advance by `size` bytes without reading them."""
+        self.file.seek(size, 1)
+
+    def read(self, size):
+        """Return up to `size` raw bytes; fewer at the end of the file."""
+        return self.file.read(size)
+
+    def unread(self, size):
+        """Step back over the last `size` bytes returned by `read`."""
+        self.file.seek(-size, 1)
+
+    def tell(self):
+        return self.file.tell()
+
+
+class BinBufferParser(object):
+    """Decode from an in-memory buffer at a moving offset.
+
+    Drop-in replacement for `BinFileParser` that avoids one `read` per
+    field. `get_bytes` returns zero-copy `memoryview` slices of the buffer.
+    """
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.offset = offset
+        self.codecs = Payload.codecs
+
+    @staticmethod
+    def from_file(file):
+        """Map `file` into memory, or read it at once if it can't be mapped."""
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            buffer = file.read()
+        return BinBufferParser(buffer)
+
+    def get(self, decoder):
+        """
+        Parameters
+        ----------
+        fmt: instance of `struct.Struct`
+             or format string accepted by `struct.unpack`
+        """
+        if isinstance(decoder, str):
+            decoder = struct.Struct(decoder)
+        offset = self.offset
+        result = decoder.unpack_from(self.buffer, offset)
+        self.offset = offset + decoder.size
+        return result
+
+    def get_one(self, decoder):
+        """
+        Parameters
+        ----------
+        fmt: instance of `struct.Struct`
+             or format string accepted by `struct.unpack`
+        """
+        if isinstance(decoder, str):
+            decoder = struct.Struct(decoder)
+        offset = self.offset
+        result = decoder.unpack_from(self.buffer, offset)[0]
+        self.offset = offset + decoder.size
+        return result
+
+    def get_bytes(self, size):
+        end = self.offset + size
+        if end > len(self.view):
+            raise struct.error('unpack requires a buffer of {} bytes'.format(size))
+        data = self.view[self.offset:end]
+        self.offset = end
+        return data
+
+    def skip(self, size):
+        """Advance by `size` bytes without reading them."""
+        end = self.offset + size
+        if end > len(self.view):
+            raise struct.error('unpack requires a buffer of {} bytes'.format(size))
+        self.offset = end
+
+    def read(self, size):
+        """Return up to `size` raw bytes; fewer at the end of the buffer."""
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def unread(self, size):
+        """Step back over the last `size` bytes returned by `read`."""
+        self.offset -= size
+
+    def tell(self):
+        return self.offset
+
+
+class InflatingParser(object):
+    """Decode from a zlib or gzip stream embedded in another parser.
+
+    Compressed input is pulled from `stream` in chunks of `chunk_size` bytes
+    and inflated only as far as the decoder asks for, so memory use is
+    bounded by the window instead of by the inflated size.
+    Call `close` when done to leave `stream` right after the compressed data.
+    """
+    def __init__(self, stream, chunk_size=16384):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # 32 + MAX_WBITS: accept both zlib and gzip headers
+        self.inflater = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self.buffer = b''
+        self.offset = 0
+        # inflated bytes dropped from the front of `buffer`
+        self.position = 0
+        self.codecs = stream.codecs
+
+    def _fill(self, size):
+        inflater = self.inflater
+        self.position += self.offset
+        parts = [self.buffer[self.offset:]]
+        available = len(parts[0])
+        while available < size:
+            data = inflater.unconsumed_tail
+            if not data:
+                if inflater.eof:
+                    raise struct.error('unpack requires a buffer of {} bytes'.format(size))
+                data = self.stream.read(self.chunk_size)
+                if not data:
+                    raise struct.error('truncated compressed stream')
+            data = inflater.decompress(data, max(self.chunk_size, size - available))
+            parts.append(data)
+            available += len(data)
+        self.buffer = b''.join(parts)
+        self.offset = 0
+
+    def get(self, decoder):
+        """
+        Parameters
+        ----------
+        fmt: instance of `struct.Struct`
+             or format string accepted by `struct.unpack`
+        """
+        if isinstance(decoder, str):
+            decoder = struct.Struct(decoder)
+        if len(self.buffer) - self.offset < decoder.size:
+            self._fill(decoder.size)
+        result = decoder.unpack_from(self.buffer, self.offset)
+        self.offset += decoder.size
+        return result
+
+    def get_one(self, decoder):
+        """
+        Parameters
+        ----------
+        fmt: instance of `struct.Struct`
+             or format string accepted by `struct.unpack`
+        """
+        return self.get(decoder)[0]
+
+    def get_bytes(self, size):
+        if len(self.buffer) - self.offset < size:
+            self._fill(size)
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def skip(self, size):
+        """Advance by `size` inflated bytes, inflating at most `chunk_size`
+        bytes more than needed at a time."""
+        while size:
+            step = min(size, self.chunk_size)
+            self.get_bytes(step)
+            size -= step
+
+    def tell(self):
+        """Position in the inflated data."""
+        return self.position + self.offset
+
+    def close(self):
+        inflater = self.inflater
+        while not inflater.eof:
+            data = inflater.unconsumed_tail or self.stream.read(self.chunk_size)
+            if not data:
+                raise struct.error('truncated compressed stream')
+            inflater.decompress(data, self.chunk_size)
+        self.stream.unread(len(inflater.unused_data))
+
+
+class DeflatingWriter(object):
+    """File-like wrapper that gzip-compresses everything written to it."""
+    def __init__(self, file, compresslevel=6):
+        self.file = file
+        # 16 + MAX_WBITS: write a gzip header
+        self.deflater = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                         16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        self.file.write(self.deflater.compress(data))
+
+    def close(self):
+        self.file.write(self.deflater.flush())
+
+
+def write_atomic(filename, data):
+    """Write `data` to a temporary file and rename it to `filename`.
+
+    Readers see either the old or the complete new file, never a partial one.
+    An existing file keeps its permissions, a new one gets the permissions
+    of any newly created file.
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except OSError:
+        mode = None
+    # created with 0o666 like open() does, so the umask applies to new files
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        tmpname = os.path.join(directory, '.{}.{}'.format(basename, os.urandom(6).hex()))
+        try:
+            fd = os.open(tmpname, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+_blocking_executor = None
+
+
+def blocking_executor():
+    """Thread pool shared by the async loaders, created on first use.
+
+    Its number of workers bounds how many files are read and decoded at once.
+    """
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(min(32, (os.cpu_count() or 1) + 4))
+    return _blocking_executor
+
+
+async def run_blocking(executor, function, *args):
+    """Await `function(*args)` called in `executor`, `blocking_executor()` if None.
+
+    Decoding in threads keeps the event loop responsive, but holds the GIL.
+    Pass a `concurrent.futures.ProcessPoolExecutor` to decode in parallel.
+    """
+    if executor is None:
+        executor = blocking_executor()
+    return await asyncio.get_running_loop().run_in_executor(executor,
+                                                            partial(function, *args))
+
+
+def open_parser(file, buffered):
+    if buffered:
+        return BinBufferParser.from_file(file)
+    return BinFileParser(file)
+
 
 class Header(object):
+    __slots__ = ('version', 'type', 'xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax',
+                 'elements')
     static_format = struct.Struct('>iiffffffI')
     element_format = struct.Struct('>HI')
     def __init__(self, version, type, xmin, ymin, zmin, xmax, ymax, zmax,
@@ -77,24 +365,54 @@ class Header(object):
         self.elements = elements
 
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, buffered=False, histogram=False):
+        """
+        Parameters
+        ----------
+        filename: path to a header.smbph file
+        buffered: map the whole file into memory and decode from the buffer
+        histogram: read `elements` into an `ElementHistogram` instead of a dict
+        """
         with open(filename, 'rb') as file:
-            stream = BinFileParser(file)
-            result = stream.get(Header.static_format)
-            n_elements = result[-1]
+            return Header.from_stream(open_parser(file, buffered), histogram)
+
+    @staticmethod
+    async def aload(filename, buffered=False, histogram=False, executor=None):
+        """Like `from_file`, reading and decoding in `executor`, see `run_blocking`."""
+        return await run_blocking(executor, Header.from_file, filename, buffered, histogram)
+
+    @staticmethod
+    def from_buffer(buffer, histogram=False):
+        return Header.from_stream(BinBufferParser(buffer), histogram)
+
+    @staticmethod
+    def from_stream(stream, histogram=False):
+        result = stream.get(Header.static_format)
+        n_elements = result[-1]
+        if histogram:
+            elements = ElementHistogram.from_records(
+                stream.get_bytes(n_elements * Header.element_format.size))
+        else:
             elements = dict(stream.get(Header.element_format) for _ in range(n_elements))
         return Header(*result[:-1], elements)
 
     def to_file(self, filename):
-        with open(filename, 'wb') as file:
-            file.write(Header.static_format.pack(self.version, self.type.value,
-                                                 self.xmin, self.ymin,
-                                                 self.zmin, self.xmax,
-                                                 self.ymax, self.zmax,
-                                                 len(self.elements)))
-            for block_id in sorted(self.elements):
-                count = self.elements[block_id]
-                file.write(Header.element_format.pack(block_id, count))
+        write_atomic(filename, self.to_bytes())
+
+    def to_bytes(self):
+        static_size = Header.static_format.size
+        element_size = Header.element_format.size
+        buffer = bytearray(static_size + element_size * len(self.elements))
+        Header.static_format.pack_into(buffer, 0, self.version, self.type.value,
+                                       self.xmin, self.ymin, self.zmin,
+                                       self.xmax, self.ymax, self.zmax,
+                                       len(self.elements))
+        pack_into = Header.element_format.pack_into
+        offset = static_size
+        for block_id in sorted(self.elements):
+            pack_into(buffer, offset, block_id, self.elements[block_id])
+            offset += element_size
+        return bytes(buffer)
 
     def __repr__(self):
         return "Header(version={}, type={}, xmin={}, ymin={}, zmin={}, " \
@@ -103,43 +421,53 @@ class Header(object):
             self.xmax, self.ymax, self.zmax, self.elements)
 
 
+length_format = struct.Struct('>H')
+
+
 class String(object):
     @staticmethod
     def deserialize(stream):
-        len = stream.get_one('>H')
-        return stream.get_one('>%ds' % len).decode('ascii')
+        len = stream.get_one(length_format)
+        return str(stream.get_bytes(len), 'ascii')
 
     @staticmethod
     def to_file(file, s):
-        file.write(struct.pack('>H', len(s)))
-        file.write(struct.pack('>%ds' % len(s), s.encode('ascii')))
+        data = s.encode('ascii')
+        file.write(length_format.pack(len(data)))
+        file.write(data)
 
 
 class ByteArray(object):
     @staticmethod
     def deserialize(stream):
-        len = stream.get_one('>H')
-        return stream.get_one('>%ds' % len)
+        len = stream.get_one(length_format)
+        # a copy, so payloads don't expose or keep alive the parser's buffer
+        return bytes(stream.get_bytes(len))
 
     @staticmethod
     def to_file(file, b):
-        file.write(struct.pack('>H', len(b)))
-        file.write(struct.pack('>%ds' % len(b), b))
+        file.write(length_format.pack(len(b)))
+        file.write(b)
 
 
 class TagList(object):
+    __slots__ = ('list', 'type')
+    header_format = struct.Struct('>bI')
+
     def __init__(self, type, tl):
         self.list = tl
         self.type = type
 
     @staticmethod
     def deserialize(stream):
-        type, length = stream.get('>bI')
+        type, length = stream.get(TagList.header_format)
+        if TypedTagList.supports(stream, type):
+            return TypedTagList.deserialize(stream, type, length)
         list = [Payload.deserialize(stream, type) for _ in range(length)]
         return TagList(type, list)
 
     def to_file(self, file):
-        file.write(struct.pack('>bI', self.type, len(self.list)))
+        file.write(TagList.header_format.pack(self.type, len(self.list)))
         for pl in self.list:
             pl.to_file(file)
 
@@ -148,6 +476,8 @@ class TagList(object):
 
 
 class TagStruct(object):
+    __slots__ = ('tags',)
+
     def __init__(self, tags):
         self.tags = tags
 
@@ -156,7 +486,7 @@ class TagStruct(object):
         tags = []
         while True:
             tag = Tag.deserialize(stream)
-            if tag.type() == 0:
+            if tag.payload.type == 0:
                 break
             tags.append(tag)
         return TagStruct(tags)
@@ -171,21 +501,31 @@ class TagStruct(object):
 
 
 class Tag(object):
+    """A named or unnamed payload.
+
+    Names are interned when decoded, so the many tags of a tree that share
+    a name share one string.
+    """
+    __slots__ = ('name', 'payload')
+    type_format = struct.Struct('>b')
+
     def __init__(self, name=None, payload=None):
         self.name = name
         self.payload = payload
 
     @staticmethod
     def deserialize(stream):
-        type = stream.get_one('>b')
+        type = stream.get_one(Tag.type_format)
+        if type == 0:
+            return EmptyTag
         name = None
         if type > 0:
-            name = String.deserialize(stream)
+            name = sys.intern(String.deserialize(stream))
         payload = Payload.deserialize(stream, abs(type))
         return Tag(name, payload)
 
     def to_file(self, file):
-        file.write(struct.pack('>b', self.type()))
+        file.write(Tag.type_format.pack(self.type()))
         if self.name is not None:
             String.to_file(file, self.name)
         self.payload.to_file(file)
@@ -202,115 +542,508 @@ class Tag(object):
         return "Tag(name={}, payload={})".format(self.name, self.payload)
 
 
+PayloadCodec = namedtuple('PayloadCodec', ['decode', 'encode'])
+
+
+def scalar_codec(fmt):
+    """Codec for a payload holding a single value of struct format `fmt`."""
+    decoder = struct.Struct(fmt)
+
+    def decode(stream):
+        return stream.get_one(decoder)
+
+    def encode(file, data):
+        file.write(decoder.pack(data))
+
+    return PayloadCodec(decode, encode)
+
+
+def vector_codec(fmt):
+    """Codec for a payload holding a tuple of values of struct format `fmt`."""
+    decoder = struct.Struct(fmt)
+
+    def decode(stream):
+        return stream.get(decoder)
+
+    def encode(file, data):
+        file.write(decoder.pack(*data))
+
+    return PayloadCodec(decode, encode)
+
+
+def _encode_nested(file, data):
+    data.to_file(file)
+
+
 class Payload(object):
+    __slots__ = ('type', 'data')
+    # Indexed by payload type. Use `register_codec` to add new types.
+    codecs = [
+        PayloadCodec(lambda stream: None, lambda file, data: None),
+        scalar_codec('b'),  # int8
+        scalar_codec('>h'),  # int16
+        scalar_codec('>i'),  # int32
+        scalar_codec('>q'),  # int64
+        scalar_codec('>f'),  # float
+        scalar_codec('>d'),  # double
+        PayloadCodec(ByteArray.deserialize, ByteArray.to_file),
+        PayloadCodec(String.deserialize, String.to_file),
+        vector_codec('>fff'),  # float vector
+        vector_codec('>iii'),  # int vector
+        vector_codec('>bbb'),  # byte vector
+        PayloadCodec(TagList.deserialize, _encode_nested),
+        PayloadCodec(TagStruct.deserialize, _encode_nested),
+        scalar_codec('b'),  # factory registration
+        vector_codec('>ffff'),  # float 4 vector
+    ]
+
     def __init__(self, type, data):
         self.type = type
         self.data = data
 
+    @staticmethod
+    def register_codec(type, decode, encode):
+        """Add support for a new payload type.
+
+        Parameters
+        ----------
+        type: payload type byte
+        decode: callable(stream) -> data
+        encode: callable(file, data)
+        """
+        if not 0 < type < 128:
+            raise ValueError('invalid tag-payload type: {}'.format(type))
+        codecs = Payload.codecs
+        codecs.extend([None] * (type + 1 - len(codecs)))
+        codecs[type] = PayloadCodec(decode, encode)
+
+    @staticmethod
+    def codec(type):
+        codecs = Payload.codecs
+        if 0 <= type < len(codecs) and codecs[type] is not None:
+            return codecs[type]
+        raise ValueError('unknown tag-payload type: {}'.format(type))
+
     @staticmethod
     def deserialize(stream, type):
+        # Dispatch through the stream, so `DecodeStats` can instrument one stream
+        codecs = stream.codecs
+        if 0 < type < len(codecs):
+            codec = codecs[type]
+            if codec is not None:
+                return Payload(type, codec.decode(stream))
         if type == 0:
-            data = None
-        elif type == 1:
-            data = stream.get_one('b')  # int8
-        elif type == 2:
-            data = stream.get_one('>h')  # int16
-        elif type == 3:
-            data = stream.get_one('>i')  # int32
-        elif type == 4:
-            data = stream.get_one('>q')  # int64
-        elif type == 5:
-            data = stream.get_one('>f')  # float
-        elif type == 6:
-            data = stream.get_one('>d')  # double
-        elif type == 7:
-            data = ByteArray.deserialize(stream)
-        elif type == 8:
-            data = String.deserialize(stream)
-        elif type == 9:
-            data = stream.get('>fff')  # float vector
-        elif type == 10:
-            data = stream.get('>iii')  # int vector
-        elif type == 11:
-            data = stream.get('>bbb')  # byte vector
-        elif type == 12:
-            data = TagList.deserialize(stream)
-        elif type == 13:
-            data = TagStruct.deserialize(stream)
-        elif type == 14:
-            data = stream.get_one('b')  # factory registration
-        elif type == 15:
-            data = stream.get('>ffff')  # float 4 vector
-        else:
-            raise ValueError('unknown tag-payload type: {}'.format(type))
-        return Payload(type, data)
+            codecs[0].decode(stream)
+            return EmptyPayload
+        raise ValueError('unknown tag-payload type: {}'.format(type))
 
     def to_file(self, file):
-        if self.type == 0:
-            return
-        elif self.type == 1:
-            file.write(struct.pack('b', self.data))
-        elif self.type == 2:
-            file.write(struct.pack('>h', self.data))
-        elif self.type == 3:
-            file.write(struct.pack('>i', self.data))
-        elif self.type == 4:
-            file.write(struct.pack('>q', self.data))
-        elif self.type == 5:
-            file.write(struct.pack('>f', self.data))
-        elif self.type == 6:
-            file.write(struct.pack('>d', self.data))
-        elif self.type == 7:
-            ByteArray.to_file(file, self.data)
-        elif self.type == 8:
-            String.to_file(file, self.data)
-        elif self.type == 9:
-            file.write(struct.pack('>fff', *self.data))
-        elif self.type == 10:
-            file.write(struct.pack('>iii', *self.data))
-        elif self.type == 11:
-            file.write(struct.pack('>bbb', *self.data))
-        elif self.type == 12:
-            self.data.to_file(file)
-        elif self.type == 13:
-            self.data.to_file(file)
-        elif self.type == 14:
-            file.write(struct.pack('b', self.data))
-        elif self.type == 15:
-            file.write(struct.pack('>ffff', *self.data))
-        else:
-            raise ValueError('unknown tag-payload type: {}'.format(self.type))
+        Payload.codec(self.type).encode(file, self.data)
 
     def __repr__(self):
         return repr(self.data)
 
 
-EmptyPayload = Payload(0, None)
-EmptyTag = Tag(name=None, payload=EmptyPayload)
+class _ReadOnly(object):
+    """Mixin for the shared end tag objects, which must not be changed."""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("the shared end tag can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("the shared end tag can't be changed")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class _EmptyPayload(_ReadOnly, Payload):
+    __slots__ = ()
+
+    def __init__(self):
+        object.__setattr__(self, 'type', 0)
+        object.__setattr__(self, 'data', None)
+
+    def __reduce__(self):
+        return 'EmptyPayload'
+
+
+class _EmptyTag(_ReadOnly, Tag):
+    __slots__ = ()
+
+    def __init__(self, payload):
+        object.__setattr__(self, 'name', None)
+        object.__setattr__(self, 'payload', payload)
+
+    def __reduce__(self):
+        return 'EmptyTag'
+
+
+# Shared by all decoded end tags
+EmptyPayload = _EmptyPayload()
+EmptyTag = _EmptyTag(EmptyPayload)
+
+
+class TypedTagList(TagList):
+    """`TagList` of numbers or fixed size vectors kept in one `array.array`.
+
+    Lists of these types are decoded with a single unpack, unless the
+    stream has its own codec for the type, and written with a single write.
+    The first read or assignment of `list` turns the array into a plain
+    list of `Payload`s, which is kept and written from then on, so changes
+    to its elements stick. Use `values`, `elements` or `item` to read the
+    numbers without converting them.
+
+    Attributes
+    ----------
+    values: `array.array` of the numbers, vector components one after the
+            other, or None once `list` was read or assigned
+    """
+    __slots__ = ('values', '_list')
+    # payload type -> (array typecode, numbers per element, bytes per element, codec)
+    formats = {type: (typecode, n, n * array(typecode).itemsize, Payload.codecs[type])
+               for type, typecode, n in [
+        (1, 'b', 1), (2, 'h', 1), (3, 'i', 1), (4, 'q', 1), (5, 'f', 1), (6, 'd', 1),
+        (9, 'f', 3), (10, 'i', 3), (11, 'b', 3), (14, 'b', 1), (15, 'f', 4)]}
+
+    def __init__(self, type, values):
+        self.type = type
+        self.values = values
+        self._list = None
+
+    @staticmethod
+    def supports(stream, type):
+        """True if lists of `type` are decoded in bulk from `stream`."""
+        format = TypedTagList.formats.get(type)
+        return format is not None and stream.codecs[type] is format[3]
+
+    @staticmethod
+    def deserialize(stream, type, length):
+        typecode, _, size, _ = TypedTagList.formats[type]
+        values = array(typecode)
+        values.frombytes(stream.get_bytes(length * size))
+        return TypedTagList(type, _swap_big_endian(values))
+
+    @property
+    def list(self):
+        return self.materialize()
+
+    @list.setter
+    def list(self, tl):
+        self._list = tl
+        self.values = None
+
+    def length(self):
+        """Number of elements, without materializing the list."""
+        if self.values is None:
+            return len(self._list)
+        return len(self.values) // TypedTagList.formats[self.type][1]
+
+    def materialize(self):
+        """Turn the array into a list of `Payload`s and return that list."""
+        if self.values is not None:
+            self._list = [Payload(self.type, data) for data in self.elements()]
+            self.values = None
+        return self._list
+
+    def item(self, i):
+        """`Payload` of element `i`; a new one while the array is kept."""
+        if self.values is None:
+            return self._list[i]
+        length = self.length()
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('list index out of range')
+        n = TypedTagList.formats[self.type][1]
+        if n == 1:
+            return Payload(self.type, self.values[i])
+        return Payload(self.type, tuple(self.values[i * n:i * n + n]))
+
+    def elements(self):
+        """Data of the elements, like the `data` of their `Payload`s."""
+        if self.values is None:
+            return [payload.data for payload in self._list]
+        n = TypedTagList.formats[self.type][1]
+        if n == 1:
+            return self.values.tolist()
+        values = self.values
+        return [tuple(values[i:i + n]) for i in range(0, len(values), n)]
+
+    def to_bytes(self):
+        """Encoded list, header included."""
+        if self.values is None:
+            file = io.BytesIO()
+            TagList.to_file(self, file)
+            return file.getvalue()
+        return (TagList.header_format.pack(self.type, self.length()) +
+                _swap_big_endian(array(self.values.typecode, self.values)).tobytes())
+
+    def to_file(self, file):
+        file.write(self.to_bytes())
+
+    def __repr__(self):
+        return '[' + ', '.join(repr(data) for data in self.elements()) + ']'
+
+
+class TagLimitError(ValueError):
+    """A tag tree is nested deeper or is larger than the decoder allows."""
+
+
+def decode_tag(stream, max_depth=None, max_bytes=None, index=None):
+    """Decode a tag tree without recursion.
+
+    Gives the same objects as `Tag.deserialize`, but keeps nested structs
+    and lists on an explicit stack, so deeply nested trees neither cost a
+    Python frame per level nor raise `RecursionError`. Leaf payloads are
+    decoded with the codecs of `stream`.
+
+    Parameters
+    ----------
+    stream: parser to decode from
+    max_depth: maximum nesting depth of structs and lists
+    max_bytes: maximum number of bytes to decode, counted in the inflated
+               data for compressed tag roots. Each list element counts at
+               least one byte, so empty lists with huge lengths are caught.
+    index: optional `tag_index.TagIndex` that records the byte range of
+           every tag and of every struct or list inside a list
+
+    Raises `TagLimitError` if a limit is exceeded.
+    """
+    start = stream.tell()
+    type = stream.get_one(Tag.type_format)
+    name = sys.intern(String.deserialize(stream)) if type > 0 else None
+    if max_bytes is not None:
+        max_bytes -= stream.tell() - start
+    return Tag(name, decode_payload(stream, abs(type), max_depth, max_bytes, index, start))
+
+
+def decode_payload(stream, type, max_depth=None, max_bytes=None, index=None, start=None):
+    """Decode a payload of `type` without recursion, see `decode_tag`.
+
+    With an `index` the payload is recorded as an entry beginning at
+    `start`, by default the current position.
+    """
+    codecs = stream.codecs
+    get_one = stream.get_one
+    get = stream.get
+    tell = stream.tell
+    read_string = String.deserialize
+    intern = sys.intern
+    type_format = Tag.type_format
+    list_format = TagList.header_format
+    if max_depth is None:
+        max_depth = float('inf')
+    limit = None if max_bytes is None else tell() + max_bytes
+    if index is not None:
+        begin, end = index.begin, index.end
+        entry = begin(tell() if start is None else start)
+
+    # Open containers as [list of children, element type or None for structs,
+    # number of list elements left, index entry]. Lists of leaf payloads are
+    # decoded in one go and never pushed.
+    stack = []
+
+    def leaf_codec(type):
+        codec = codecs[type] if 0 <= type < len(codecs) else None
+        if codec is None:
+            raise ValueError('unknown tag-payload type: {}'.format(type))
+        return codec
+
+    def container(type, entry):
+        if len(stack) >= max_depth:
+            raise TagLimitError('tag tree nested deeper than {}'.format(max_depth))
+        if type == 13:
+            data = TagStruct([])
+            stack.append([data.tags, None, 0, entry])
+            return Payload(type, data)
+        element_type, length = get(list_format)
+        typed = TypedTagList.supports(stream, element_type)
+        if limit is not None and tell() + length * (
+                TypedTagList.formats[element_type][2] if typed else 1) > limit:
+            raise TagLimitError('tag list of {} elements exceeds {} bytes'.format(
+                length, max_bytes))
+        if typed:
+            data = TypedTagList.deserialize(stream, element_type, length)
+            if index is not None:
+                end(entry, tell())
+        elif element_type == 12 or element_type == 13:
+            data = TagList(element_type, [])
+            stack.append([data.list, element_type, length, entry])
+        else:
+            decode = leaf_codec(element_type).decode
+            data = TagList(element_type, [Payload(element_type, decode(stream))
+                                          for _ in range(length)])
+            if index is not None:
+                end(entry, tell())
+        return Payload(type, data)
+
+    if type == 12 or type == 13:
+        root = container(type, entry if index is not None else None)
+    else:
+        root = Payload(type, leaf_codec(type).decode(stream))
+        if index is not None:
+            end(entry, tell())
+    while stack:
+        if limit is not None and tell() > limit:
+            raise TagLimitError('tag tree exceeds {} bytes'.format(max_bytes))
+        frame = stack[-1]
+        children, element_type, length, entry = frame
+        if element_type is None:
+            if index is not None:
+                position = tell()
+            type = get_one(type_format)
+            if type == 0:
+                stack.pop()
+                if index is not None:
+                    end(entry, tell())
+                continue
+            name = None
+            if type > 0:
+                name = intern(read_string(stream))
+            else:
+                type = -type
+            if index is not None:
+                entry = begin(position)
+            if type == 12 or type == 13:
+                children.append(Tag(name, container(type, entry)))
+            else:
+                children.append(Tag(name, Payload(type, leaf_codec(type).decode(stream))))
+                if index is not None:
+                    end(entry, tell())
+        elif length:
+            frame[2] = length - 1
+            if index is not None:
+                entry = begin(tell())
+            children.append(container(element_type, entry))
+        else:
+            stack.pop()
+            if index is not None:
+                end(entry, tell())
+    if limit is not None and tell() > limit:
+        raise TagLimitError('tag tree exceeds {} bytes'.format(max_bytes))
+    return root
+
+
+def encode_tag(file, tag):
+    """Write a tag tree without recursion, byte for byte like `Tag.to_file`.
+
+    Containers with a `pieces` method, like those of `TagIndex.open`, are
+    written as the tags, payloads and raw bytes that method yields.
+    """
+    write = file.write
+    type_format = Tag.type_format
+    list_format = TagList.header_format
+    end = type_format.pack(0)
+    # Iterators over the children of open containers, and whether the
+    # container is a struct that needs an end tag
+    stack = [(iter([tag]), False)]
+    while stack:
+        children, is_struct = stack[-1]
+        item = next(children, None)
+        if item is None:
+            stack.pop()
+            if is_struct:
+                write(end)
+            continue
+        if isinstance(item, Tag):
+            write(type_format.pack(item.type()))
+            if item.name is not None:
+                String.to_file(file, item.name)
+            item = item.payload
+            if item is None:
+                continue
+        elif not isinstance(item, Payload):
+            write(item)
+            continue
+        type, data = item.type, item.data
+        if type == 12 or type == 13:
+            pieces = getattr(data, 'pieces', None)
+            if pieces is not None:
+                stack.append((pieces(), False))
+                continue
+        if type == 13:
+            stack.append((iter(data.tags), True))
+        elif type == 12 and isinstance(data, TypedTagList) and data.values is not None:
+            write(data.to_bytes())
+        elif type == 12:
+            write(list_format.pack(data.type, len(data.list)))
+            if data.type == 12 or data.type == 13:
+                stack.append((iter(data.list), False))
+            else:
+                encode = Payload.codec(data.type).encode
+                for element in data.list:
+                    encode(file, element.data)
+        else:
+            Payload.codec(type).encode(file, data)
 
 
 class TagRoot(object):
+    compressed_version = 0x1
+
     def __init__(self, version=0, tag=EmptyTag):
         self.version = version
         self.tag = tag
 
     @staticmethod
-    def deserialize(stream):
-        version = stream.get_one('>H')
-        if version == 0x1:
-            raise NotImplementedError('Compressed tags not supported yet.')
-        tag = Tag.deserialize(stream)
+    def deserialize(stream, max_depth=None, max_bytes=None, index=None):
+        """
+        Parameters
+        ----------
+        stream: parser to decode from
+        max_depth, max_bytes: limits on the tag tree, see `decode_tag`
+        index: optional `tag_index.TagIndex` to record the tag tree in
+
+        Streams with their own codec table, e.g. one instrumented by
+        `DecodeStats`, are decoded recursively through their codecs unless
+        limits are given.
+        """
+        version = stream.get_one(length_format)
+        if index is not None:
+            index.set_root(version, stream.tell())
+        if version == TagRoot.compressed_version:
+            inflated = InflatingParser(stream)
+            tag = TagRoot._decode(inflated, max_depth, max_bytes, index)
+            inflated.close()
+        else:
+            tag = TagRoot._decode(stream, max_depth, max_bytes, index)
         return TagRoot(version, tag)
 
-    def to_file(self, file):
-        file.write(struct.pack('>H', self.version))
-        self.tag.to_file(file)
+    @staticmethod
+    def _decode(stream, max_depth, max_bytes, index):
+        if (stream.codecs is not Payload.codecs and max_depth is None and
+                max_bytes is None and index is None):
+            return Tag.deserialize(stream)
+        return decode_tag(stream, max_depth, max_bytes, index)
+
+    def to_file(self, file, compresslevel=6):
+        """
+        Parameters
+        ----------
+        file: file-like object to write to
+        compresslevel: zlib compression level (0-9) used if the tag root
+                       is compressed, i.e. `version` is 0x1
+        """
+        file.write(length_format.pack(self.version))
+        if self.version == TagRoot.compressed_version:
+            deflated = DeflatingWriter(file, compresslevel)
+            encode_tag(deflated, self.tag)
+            deflated.close()
+        else:
+            encode_tag(file, self.tag)
 
     def __repr__(self):
         return "TagRoot(version={}, tag={}".format(self.version, self.tag)
 
 
 class MetaDockedEntry(object):
+    __slots__ = ('name', 'pos', 'size', 'style', 'orientation')
+    static_format = struct.Struct('>iiifffhb')
+
     def __init__(self, name, pos, size, style, orientation):
         self.name = name
         self.pos = tuple(pos)
@@ -321,16 +1054,13 @@ class MetaDockedEntry(object):
     @staticmethod
     def from_file(stream):
         name = String.deserialize(stream)
-        pos = stream.get('>iii')
-        size = stream.get('>fff')
-        style, orientation = stream.get('>hb')
-        return MetaDockedEntry(name, pos, size, style, orientation)
+        result = stream.get(MetaDockedEntry.static_format)
+        return MetaDockedEntry(name, result[0:3], result[3:6], *result[6:])
 
     def to_file(self, file):
         String.to_file(file, self.name)
-        file.write(struct.pack('>iii', *self.pos))
-        file.write(struct.pack('>fff', *self.size))
-        file.write(struct.pack('>hb', self.style, self.orientation))
+        file.write(MetaDockedEntry.static_format.pack(
+            *(self.pos + self.size + (self.style, self.orientation))))
 
 
 class Meta(object):
@@ -340,42 +1070,534 @@ class Meta(object):
         self.tags = tags
 
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, buffered=False, stats=None, max_depth=None, max_bytes=None,
+                  index=None):
+        """
+        Parameters
+        ----------
+        filename: path to a meta.smbpm file
+        buffered: map the whole file into memory and decode from the buffer
+        stats: optional `decode_stats.DecodeStats` that records what the
+               decoding time is spent on
+        max_depth, max_bytes: limits on the tag tree for untrusted files,
+                              see `decode_tag`
+        index: optional `tag_index.TagIndex` that records the byte range of
+               every tag, for random access to the file later on
+        """
+        if index is not None:
+            index.set_source(filename)
         with open(filename, 'rb') as file:
-            stream = BinFileParser(file)
-            version, = stream.get('>i')
-            docked = None
-            tags = None
-            while True:
-                tag = TagTypes(stream.get_one('>b'))
-
-                if tag == TagTypes.finish:
-                    break
-                elif tag == TagTypes.segment_manager:
-                    tags = TagRoot.deserialize(stream)
-                    break
-                elif tag == TagTypes.docking:
-                    docked_count = stream.get_one('>I')
-                    docked = [MetaDockedEntry.from_file(stream) for _ in
-                              range(docked_count)]
+            return Meta.from_stream(open_parser(file, buffered), stats, max_depth, max_bytes,
+                                    index)
+
+    @staticmethod
+    async def aload(filename, buffered=False, max_depth=None, max_bytes=None, executor=None):
+        """Like `from_file`, reading and decoding in `executor`, see `run_blocking`."""
+        return await run_blocking(executor, partial(Meta.from_file, max_depth=max_depth,
+                                                    max_bytes=max_bytes),
+                                  filename, buffered)
+
+    @staticmethod
+    def from_buffer(buffer, stats=None, max_depth=None, max_bytes=None, index=None):
+        return Meta.from_stream(BinBufferParser(buffer), stats, max_depth, max_bytes, index)
+
+    @staticmethod
+    def from_stream(stream, stats=None, max_depth=None, max_bytes=None, index=None):
+        if stats is not None:
+            stats.attach(stream)
+        version, = stream.get('>i')
+        docked = None
+        tags = None
+        while True:
+            tag = TagTypes(stream.get_one('>b'))
+
+            if tag == TagTypes.finish:
+                break
+            elif tag == TagTypes.segment_manager:
+                tags = TagRoot.deserialize(stream, max_depth, max_bytes, index)
+                break
+            elif tag == TagTypes.docking:
+                if stats is not None:
+                    start, t0 = stream.tell(), perf_counter()
+                docked_count = stream.get_one('>I')
+                docked = [MetaDockedEntry.from_file(stream) for _ in
+                          range(docked_count)]
+                if stats is not None:
+                    stats.record('docking', stream.tell() - start, perf_counter() - t0)
 
         return Meta(version, docked, tags)
 
+    def to_file(self, filename, compresslevel=6):
+        write_atomic(filename, self.to_bytes(compresslevel))
+
+    def to_bytes(self, compresslevel=6):
+        file = io.BytesIO()
+        self.to_stream(file, compresslevel)
+        return file.getvalue()
+
+    def to_stream(self, file, compresslevel=6):
+        file.write(struct.pack('>i', self.version))
+
+        if self.docked is not None:
+            file.write(struct.pack('>b', TagTypes.docking.value))
+            file.write(struct.pack('>I', len(self.docked)))
+            for d in self.docked:
+                d.to_file(file)
+
+        if self.tags is not None:
+            file.write(struct.pack('>b', TagTypes.segment_manager.value))
+            self.tags.to_file(file, compresslevel)
+
+        file.write(struct.pack('>b', TagTypes.finish.value))
+
+
+class Logic(object):
+    """Links from controller blocks to the blocks they control (logic.smbpl).
+
+    The links are kept in flat arrays instead of nested containers.
+    Controller `i` is at `controllers[3 * i:3 * i + 3]` and owns the groups
+    `group_offsets[i]` up to `group_offsets[i + 1]`. Group `j` links blocks
+    of id `group_types[j]`, found at `blocks[3 * k:3 * k + 3]` for `k` from
+    `block_offsets[j]` up to `block_offsets[j + 1]`.
+
+    Attributes
+    ----------
+    version: file version
+    controllers, blocks: `array('h')` of x, y, z coordinates
+    group_offsets, block_offsets: `array('I')` of start indices, one more
+                                  than there are controllers or groups
+    group_types: `array('H')` of block ids
+
+    The lookup indexes are built on first use. Don't modify the arrays
+    after that.
+    """
+    static_format = struct.Struct('>ii')
+    controller_format = struct.Struct('>hhhi')
+    group_format = struct.Struct('>Hi')
+
+    def __init__(self, version=0, controllers=None, group_offsets=None, group_types=None,
+                 block_offsets=None, blocks=None):
+        self.version = version
+        self.controllers = array('h') if controllers is None else controllers
+        self.group_offsets = array('I', [0]) if group_offsets is None else group_offsets
+        self.group_types = array('H') if group_types is None else group_types
+        self.block_offsets = array('I', [0]) if block_offsets is None else block_offsets
+        self.blocks = array('h') if blocks is None else blocks
+        self._controller_index = None
+        self._reverse = None
+
+    @staticmethod
+    def from_file(filename, buffered=False):
+        with open(filename, 'rb') as file:
+            return Logic.from_stream(open_parser(file, buffered))
+
+    @staticmethod
+    def from_buffer(buffer):
+        return Logic.from_stream(BinBufferParser(buffer))
+
+    @staticmethod
+    def from_stream(stream):
+        version, n_controllers = stream.get(Logic.static_format)
+        logic = Logic(version)
+        controllers, group_types = logic.controllers, logic.group_types
+        group_offsets, block_offsets = logic.group_offsets, logic.block_offsets
+        chunks = []
+        n_blocks = 0
+        for _ in range(n_controllers):
+            x, y, z, n_groups = stream.get(Logic.controller_format)
+            controllers.extend((x, y, z))
+            for _ in range(n_groups):
+                block_id, count = stream.get(Logic.group_format)
+                if count < 0:
+                    raise ValueError('negative block count in logic group: {}'.format(count))
+                group_types.append(block_id)
+                chunks.append(stream.get_bytes(6 * count))
+                n_blocks += count
+                block_offsets.append(n_blocks)
+            group_offsets.append(len(group_types))
+        logic.blocks.frombytes(b''.join(chunks))
+        _swap_big_endian(logic.blocks)
+        return logic
+
+    @staticmethod
+    def from_dict(links, version=0):
+        """Build from a dict of controller (x, y, z) -> dict of block id ->
+        list of controlled (x, y, z)."""
+        logic = Logic(version)
+        for controller, groups in links.items():
+            logic.controllers.extend(controller)
+            for block_id, positions in groups.items():
+                logic.group_types.append(block_id)
+                for position in positions:
+                    logic.blocks.extend(position)
+                logic.block_offsets.append(len(logic.blocks) // 3)
+            logic.group_offsets.append(len(logic.group_types))
+        return logic
+
+    def to_dict(self):
+        return {self.controller(i): self.groups(i) for i in range(len(self))}
+
     def to_file(self, filename):
-        with open(filename, 'wb') as file:
-            file.write(struct.pack('>i', self.version))
+        write_atomic(filename, self.to_bytes())
+
+    def to_bytes(self):
+        parts = [Logic.static_format.pack(self.version, len(self))]
+        blocks = _swap_big_endian(array('h', self.blocks)).tobytes()
+        group_offsets, block_offsets = self.group_offsets, self.block_offsets
+        for i in range(len(self)):
+            first, last = group_offsets[i], group_offsets[i + 1]
+            parts.append(Logic.controller_format.pack(*(self.controller(i) +
+                                                        (last - first,))))
+            for j in range(first, last):
+                start, end = block_offsets[j], block_offsets[j + 1]
+                parts.append(Logic.group_format.pack(self.group_types[j], end - start))
+                parts.append(blocks[6 * start:6 * end])
+        return b''.join(parts)
+
+    def __len__(self):
+        return len(self.controllers) // 3
+
+    def controller(self, i):
+        """Position of controller `i`."""
+        return tuple(self.controllers[3 * i:3 * i + 3])
+
+    def _positions(self, start, end):
+        blocks = self.blocks
+        return [tuple(blocks[k:k + 3]) for k in range(3 * start, 3 * end, 3)]
+
+    def groups(self, i):
+        """Dict of block id -> list of positions controlled by controller `i`."""
+        block_offsets = self.block_offsets
+        return {self.group_types[j]: self._positions(block_offsets[j], block_offsets[j + 1])
+                for j in range(self.group_offsets[i], self.group_offsets[i + 1])}
+
+    def group(self, position):
+        """Like `groups`, for the controller at `position`; empty if there
+        is none."""
+        if self._controller_index is None:
+            self._controller_index = {self.controller(i): i for i in range(len(self))}
+        i = self._controller_index.get(tuple(position))
+        return {} if i is None else self.groups(i)
+
+    def controlled_by(self, position):
+        """List of (controller position, block id) of the groups that
+        control the block at `position`."""
+        if self._reverse is None:
+            blocks = self.blocks
+            keys = [_position_key(*blocks[k:k + 3]) for k in range(0, len(blocks), 3)]
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self._reverse = (array('q', [keys[k] for k in order]), array('I', order))
+        keys, order = self._reverse
+        key = _position_key(*position)
+        result = []
+        for n in range(bisect_left(keys, key), bisect_right(keys, key)):
+            group = bisect_right(self.block_offsets, order[n]) - 1
+            controller = bisect_right(self.group_offsets, group) - 1
+            result.append((self.controller(controller), self.group_types[group]))
+        return result
+
+    def __repr__(self):
+        return "Logic(version={}, controllers={}, links={})".format(
+            self.version, len(self), len(self.blocks) // 3)
+
+
+def _position_key(x, y, z):
+    """Sortable int of an int16 (x, y, z) position."""
+    return (x + 0x8000) << 32 | (y + 0x8000) << 16 | (z + 0x8000)
+
+
+Blueprint = namedtuple('Blueprint', ['path', 'header', 'meta'])
+
+
+def load_blueprint(path, buffered=False):
+    """Header and meta of the blueprint in directory `path`."""
+    return Blueprint(path, Header.from_file(os.path.join(path, 'header.smbph'), buffered),
+                     Meta.from_file(os.path.join(path, 'meta.smbpm'), buffered))
+
+
+async def aload_blueprint(path, buffered=False, executor=None):
+    """Like `load_blueprint`, loading header and meta concurrently in
+    `executor`, see `run_blocking`."""
+    header, meta = await asyncio.gather(
+        Header.aload(os.path.join(path, 'header.smbph'), buffered, executor=executor),
+        Meta.aload(os.path.join(path, 'meta.smbpm'), buffered, executor=executor))
+    return Blueprint(path, header, meta)
 
-            if self.docked is not None:
-                file.write(struct.pack('>b', TagTypes.docking.value))
-                file.write(struct.pack('>I', len(self.docked)))
-                for d in self.docked:
-                    d.to_file(file)
 
-            if self.tags is not None:
-                file.write(struct.pack('>b', TagTypes.segment_manager.value))
-                self.tags.to_file(file)
+BLOCK_ID_MASK = 0x7ff
+BLOCK_HP_SHIFT, BLOCK_HP_MASK = 11, 0xff
+BLOCK_ACTIVE_SHIFT = 19
+BLOCK_ORIENTATION_SHIFT, BLOCK_ORIENTATION_MASK = 20, 0xf
 
-            file.write(struct.pack('>b', TagTypes.finish.value))
+BlockInfo = namedtuple('BlockInfo', ['id', 'hitpoints', 'active', 'orientation'])
+
+# Keeps the low three bits of every byte, used to extract 11 bit block ids
+_low3_table = bytes(bytearray(i & 0x7 for i in range(256)))
+
+
+def _swap_big_endian(a):
+    """Convert array `a` between big-endian and native byte order in place."""
+    if sys.byteorder == 'little':
+        a.byteswap()
+    return a
+
+
+class Segment(object):
+    """One 32x32x32 block segment of a region file.
+
+    Blocks are kept in a single `array('I')` of raw 24 bit block values,
+    indexed by `Segment.index(x, y, z)`.
+    """
+    size = 32
+    n_blocks = size ** 3
+    header_format = struct.Struct('>bqiiibI')
+
+    def __init__(self, position, blocks=None, timestamp=0, version=2, type=1):
+        self.position = tuple(position)
+        if blocks is None:
+            blocks = array('I', bytes(4 * Segment.n_blocks))
+        self.blocks = blocks
+        self.timestamp = timestamp
+        self.version = version
+        self.type = type
+
+    @staticmethod
+    def index(x, y, z):
+        return (z * Segment.size + y) * Segment.size + x
+
+    @staticmethod
+    def deserialize(stream):
+        version, timestamp, x, y, z, type, length = stream.get(Segment.header_format)
+        if length:
+            data = zlib.decompress(stream.get_bytes(length))
+            if len(data) != 3 * Segment.n_blocks:
+                raise ValueError('bad segment data size: {}'.format(len(data)))
+            padded = bytearray(4 * Segment.n_blocks)
+            padded[1::4] = data[0::3]
+            padded[2::4] = data[1::3]
+            padded[3::4] = data[2::3]
+            blocks = _swap_big_endian(array('I', padded))
+        else:
+            blocks = None
+        return Segment((x, y, z), blocks, timestamp, version, type)
+
+    def to_bytes(self, compresslevel=6):
+        raw = _swap_big_endian(array('I', self.blocks)).tobytes()
+        data = bytearray(3 * Segment.n_blocks)
+        data[0::3] = raw[1::4]
+        data[1::3] = raw[2::4]
+        data[2::3] = raw[3::4]
+        data = zlib.compress(data, compresslevel)
+        return Segment.header_format.pack(self.version, self.timestamp,
+                                          *(self.position + (self.type, len(data)))) + data
+
+    def ids(self):
+        """Block ids of all blocks as `array('H')`."""
+        raw = _swap_big_endian(array('I', self.blocks)).tobytes()
+        packed = bytearray(2 * Segment.n_blocks)
+        packed[0::2] = raw[2::4].translate(_low3_table)
+        packed[1::2] = raw[3::4]
+        return _swap_big_endian(array('H', packed))
+
+    def block(self, x, y, z):
+        value = self.blocks[Segment.index(x, y, z)]
+        return BlockInfo(value & BLOCK_ID_MASK,
+                         (value >> BLOCK_HP_SHIFT) & BLOCK_HP_MASK,
+                         bool((value >> BLOCK_ACTIVE_SHIFT) & 1),
+                         (value >> BLOCK_ORIENTATION_SHIFT) & BLOCK_ORIENTATION_MASK)
+
+    def set_block(self, x, y, z, id, hitpoints=0, active=False, orientation=0):
+        self.blocks[Segment.index(x, y, z)] = (
+            (id & BLOCK_ID_MASK) |
+            (hitpoints & BLOCK_HP_MASK) << BLOCK_HP_SHIFT |
+            bool(active) << BLOCK_ACTIVE_SHIFT |
+            (orientation & BLOCK_ORIENTATION_MASK) << BLOCK_ORIENTATION_SHIFT)
+
+    def __repr__(self):
+        return "Segment(position={}, timestamp={})".format(self.position,
+                                                           self.timestamp)
+
+
+class SegmentFile(object):
+    """Lazy reader for a region file (DATA/*.smd2) of 16x16x16 segments.
+
+    The file is memory-mapped and its segment index parsed up front;
+    segments are inflated only when accessed, and not cached. An empty
+    file has no segments.
+    """
+    region_size = 16
+    n_segments = region_size ** 3
+    sector_size = 5120
+    header_size = 4 + n_segments * 8 + n_segments * 8
+
+    def __init__(self, filename):
+        self.filename = filename
+        n = SegmentFile.n_segments
+        with open(filename, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # can't be mapped
+                self.buffer = None
+                self.version = 0
+                self.sectors = array('i', [-1]) * n
+                self.lengths = array('i', bytes(4 * n))
+                self.timestamps = array('q', bytes(8 * n))
+                return
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        stream = BinBufferParser(self.buffer)
+        self.version = stream.get_one('>i')
+        index = array('i')
+        index.frombytes(stream.get_bytes(8 * SegmentFile.n_segments))
+        _swap_big_endian(index)
+        timestamps = array('q')
+        timestamps.frombytes(stream.get_bytes(8 * SegmentFile.n_segments))
+        _swap_big_endian(timestamps)
+        self.sectors = index[0::2]
+        self.lengths = index[1::2]
+        self.timestamps = timestamps
+
+    @staticmethod
+    def local_index(x, y, z):
+        return (z * SegmentFile.region_size + y) * SegmentFile.region_size + x
+
+    def indices(self):
+        """Local indices of the segments present, in file order."""
+        sectors = self.sectors
+        return sorted((i for i in range(SegmentFile.n_segments)
+                       if sectors[i] >= 0), key=sectors.__getitem__)
+
+    def __len__(self):
+        return SegmentFile.n_segments - self.sectors.count(-1)
+
+    def __contains__(self, i):
+        return self.sectors[i] >= 0
+
+    def raw(self, i):
+        """Compressed bytes of segment `i` including the segment header."""
+        sector = self.sectors[i]
+        if sector < 0:
+            raise KeyError(i)
+        start = SegmentFile.header_size + sector * SegmentFile.sector_size
+        return memoryview(self.buffer)[start:start + self.lengths[i]]
+
+    def __getitem__(self, i):
+        return Segment.deserialize(BinBufferParser(self.raw(i)))
+
+    def __iter__(self):
+        for i in self.indices():
+            yield self[i]
+
+    def load(self, indices=None, workers=None, ordered=True):
+        """Inflate segments in a thread pool.
+
+        Parameters
+        ----------
+        indices: local indices of the segments to load, all if None
+        workers: number of threads, see `concurrent.futures.ThreadPoolExecutor`
+        ordered: yield segments in the order of `indices` if True,
+                 otherwise as soon as they are inflated
+        """
+        if indices is None:
+            indices = self.indices()
+        return imap_threaded(self.__getitem__, indices, workers, ordered)
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def to_file(filename, segments, version=0, compresslevel=6):
+        """
+        Parameters
+        ----------
+        filename: path of the region file to write
+        segments: dict of local index -> `Segment`
+        """
+        n = SegmentFile.n_segments
+        index = array('i', [-1, 0] * n)
+        timestamps = array('q', [0] * n)
+        body = io.BytesIO()
+        sector = 0
+        for i in sorted(segments):
+            data = segments[i].to_bytes(compresslevel)
+            index[2 * i] = sector
+            index[2 * i + 1] = len(data)
+            timestamps[i] = segments[i].timestamp
+            sectors = -(-len(data) // SegmentFile.sector_size)
+            body.write(data)
+            body.write(bytes(sectors * SegmentFile.sector_size - len(data)))
+            sector += sectors
+        write_atomic(filename, struct.pack('>i', version) +
+                     _swap_big_endian(index).tobytes() +
+                     _swap_big_endian(timestamps).tobytes() + body.getvalue())
+
+
+def imap_threaded(function, items, workers=None, ordered=True):
+    """Like `map`, but calls `function` in a pool of `workers` threads.
+
+    At most two calls per worker are in flight, so results don't pile up
+    when the consumer is slower than the pool. Closing the generator early
+    cancels the calls that haven't started and waits for the running ones.
+    """
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    items = iter(items)
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque(pool.submit(function, item)
+                        for item in islice(items, 2 * workers))
+        try:
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                pending.extend(pool.submit(function, item)
+                               for item in islice(items, len(done)))
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def region_files(path):
+    """Region files of the blueprint in directory `path`, sorted by name."""
+    return sorted(glob(os.path.join(path, 'DATA', '*.smd2')))
+
+
+def load_segments(path, select=None, workers=None, ordered=True):
+    """Inflate the segments of the blueprint in directory `path` in a thread pool.
+
+    Parameters
+    ----------
+    path: blueprint directory
+    select: optional callable(region_filename, local_index) -> bool
+            choosing the segments to load
+    workers: number of threads, see `concurrent.futures.ThreadPoolExecutor`
+    ordered: yield segments in file order if True, otherwise as soon as
+             they are inflated
+    """
+    regions = [SegmentFile(filename) for filename in region_files(path)]
+    try:
+        items = ((region, i) for region in regions for i in region.indices()
+                 if select is None or select(region.filename, i))
+        segments = imap_threaded(lambda item: item[0][item[1]], items, workers, ordered)
+        try:
+            for segment in segments:
+                yield segment
+        finally:
+            # no worker may still read from the regions when they are unmapped
+            segments.close()
+    finally:
+        for region in regions:
+            region.close()
 
 #meta = Meta.from_file("../data/Isanth-VI/meta.smbpm")
 #meta = Meta.from_file("/home/billinger/.local/share/Steam/SteamApps/common/StarMade/StarMade/blueprints-stations/pirate/Piratestation Alpha/meta.smbpm")
@@ -0,0 +1,230 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+
+from devtools.catalog import content_hash, file_states, find_blueprints, scan_blueprints
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blueprints (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    version INTEGER,
+    type TEXT,
+    xmin REAL, ymin REAL, zmin REAL,
+    xmax REAL, ymax REAL, zmax REAL,
+    blocks INTEGER,
+    docked INTEGER,
+    error TEXT,
+    meta_error TEXT
+);
+CREATE TABLE IF NOT EXISTS elements (
+    blueprint INTEGER NOT NULL REFERENCES blueprints(id) ON DELETE CASCADE,
+    block_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (blueprint, block_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS elements_by_block ON elements (block_id, count);
+CREATE TABLE IF NOT EXISTS files (
+    blueprint TEXT NOT NULL REFERENCES blueprints(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash INTEGER,
+    PRIMARY KEY (blueprint, name)
+) WITHOUT ROWID;
+"""
+
+# Paths of the blueprints added, changed and removed by `BlueprintIndex.update`
+IndexDelta = namedtuple('IndexDelta', ['added', 'changed', 'removed'])
+
+_columns = ['path', 'version', 'type', 'xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax',
+            'blocks', 'docked', 'error', 'meta_error']
+
+
+class BlueprintIndex(object):
+    """SQLite database of blueprint headers and docked entity counts.
+
+    Parameters
+    ----------
+    filename: database file, created if missing
+    """
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, record):
+        """Insert or replace a record as produced by `catalog.scan_blueprint`."""
+        row = dict.fromkeys(_columns)
+        row.update((k, v) for k, v in record.items() if k in row)
+        if 'bounding_box' in record:
+            for k, v in zip(['xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax'],
+                            record['bounding_box']):
+                row[k] = v
+        with self.connection as c:
+            c.execute('DELETE FROM blueprints WHERE path = ?', (record['path'],))
+            id = c.execute('INSERT INTO blueprints ({}) VALUES ({})'.format(
+                ', '.join(_columns), ', '.join('?' * len(_columns))),
+                [row[k] for k in _columns]).lastrowid
+            c.executemany('INSERT INTO elements VALUES (?, ?, ?)',
+                          ((id, int(block_id), count)
+                           for block_id, count in record.get('elements', {}).items()))
+            c.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                          ((record['path'], name, size, mtime, hash)
+                           for name, (size, mtime, hash) in record.get('files', {}).items()))
+
+    def remove(self, path):
+        with self.connection as c:
+            c.execute('DELETE FROM blueprints WHERE path = ?', (os.path.realpath(path),))
+
+    def build(self, root, processes=None):
+        """Scan all blueprints below `root` into the index.
+
+        Same as `update`; only blueprints that are new or changed since the
+        last scan are parsed.
+        """
+        return self.update(root, processes)
+
+    def update(self, root, processes=None):
+        """Bring the index in line with the blueprints below `root`.
+
+        The size and modification time of every file of every blueprint are
+        compared with the stored ones. Blueprints with new, deleted or
+        modified files are parsed again. A header or meta file that was only
+        touched is hashed and doesn't count as modified. Other files, like
+        segment files, are never read.
+
+        Blueprints are stored by their real path, see `find_blueprints`.
+
+        Returns an `IndexDelta`.
+        """
+        prefix = os.path.join(os.path.realpath(root), '')
+        indexed = {path for path, in self.connection.execute('SELECT path FROM blueprints')
+                   if os.path.abspath(path).startswith(prefix)}
+        present = list(find_blueprints(root))
+
+        added = [path for path in present if path not in indexed]
+        changed = [path for path in present if path in indexed and self._changed(path)]
+        removed = sorted(indexed.difference(present))
+
+        for record in scan_blueprints(added + changed, meta=True, processes=processes,
+                                      files=True):
+            self.add(record)
+        for path in removed:
+            self.remove(path)
+        return IndexDelta(added, changed, removed)
+
+    def _changed(self, path):
+        stored = {name: (size, mtime, hash) for name, size, mtime, hash in
+                  self.connection.execute('SELECT name, size, mtime_ns, hash FROM files '
+                                          'WHERE blueprint = ?', (path,))}
+        current = file_states(path)
+        if set(stored) != set(current):
+            return True
+        touched = []
+        for name, (size, mtime) in current.items():
+            stored_size, stored_mtime, stored_hash = stored[name]
+            if (size, mtime) == (stored_size, stored_mtime):
+                continue
+            if size != stored_size or stored_hash is None or \
+                    content_hash(os.path.join(path, name)) != stored_hash:
+                return True
+            touched.append((mtime, path, name))
+        if touched:
+            with self.connection as c:
+                c.executemany('UPDATE files SET mtime_ns = ? WHERE blueprint = ? AND name = ?',
+                              touched)
+        return False
+
+    def get(self, path):
+        """Record of the blueprint at `path`, or None."""
+        row = self.connection.execute('SELECT id, {} FROM blueprints WHERE path = ?'.format(
+            ', '.join(_columns)), (os.path.realpath(path),)).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(_columns, row[1:]))
+        record['elements'] = dict(self.connection.execute(
+            'SELECT block_id, count FROM elements WHERE blueprint = ? ORDER BY block_id',
+            (row[0],)))
+        return record
+
+    def errors(self):
+        """(path, error) of all blueprints whose header failed to parse."""
+        return self.connection.execute(
+            'SELECT path, error FROM blueprints WHERE error IS NOT NULL ORDER BY path').fetchall()
+
+    def meta_errors(self):
+        """(path, error) of all blueprints with a valid header whose meta file
+        failed to parse. They are indexed without a docked count."""
+        return self.connection.execute(
+            'SELECT path, meta_error FROM blueprints WHERE meta_error IS NOT NULL '
+            'ORDER BY path').fetchall()
+
+    def query(self, type=None, min_elements=None, max_elements=None, max_size=None,
+              min_docked=None, max_docked=None):
+        """Paths of the blueprints matching all given conditions.
+
+        Parameters
+        ----------
+        type: entity type name, e.g. 'ship'
+        min_elements: dict of block id -> minimum count
+        max_elements: dict of block id -> maximum count
+        max_size: maximum extent of the bounding box along each axis
+        min_docked, max_docked: bounds on the number of docked entities
+        """
+        where = ['b.error IS NULL']
+        params = []
+        if type is not None:
+            where.append('b.type = ?')
+            params.append(type)
+        if max_size is not None:
+            where.extend('b.{0}max - b.{0}min <= ?'.format(axis) for axis in 'xyz')
+            params.extend([max_size] * 3)
+        if min_docked is not None:
+            where.append('b.docked >= ?')
+            params.append(min_docked)
+        if max_docked is not None:
+            where.append('b.docked <= ?')
+            params.append(max_docked)
+        for block_id, count in sorted((min_elements or {}).items()):
+            where.append('EXISTS (SELECT 1 FROM elements e WHERE e.blueprint = b.id '
+                         'AND e.block_id = ? AND e.count >= ?)')
+            params.extend([block_id, count])
+        for block_id, count in sorted((max_elements or {}).items()):
+            where.append('COALESCE((SELECT e.count FROM elements e WHERE e.blueprint = b.id '
+                         'AND e.block_id = ?), 0) <= ?')
+            params.extend([block_id, count])
+        sql = 'SELECT b.path FROM blueprints b WHERE {} ORDER BY b.path'.format(
+            ' AND '.join(where))
+        return [path for path, in self.connection.execute(sql, params)]
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM blueprints').fetchone()[0]
@@ -0,0 +1,153 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import zlib
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+
+from devtools.blueprint_files import Header, Meta
+
+
+# Files of a blueprint that are parsed and whose content is hashed on a scan
+HASHED_FILES = ('header.smbph', 'meta.smbpm')
+
+
+def find_blueprints(root):
+    """Yield all blueprint directories below `root`, in sorted order.
+
+    A blueprint directory is one containing a header.smbph. Directories
+    inside a blueprint (DATA, ATTACHED_*) are not searched. The paths are
+    below `os.path.realpath(root)`, so they are the same however `root`
+    is spelled.
+    """
+    for dirpath, dirnames, filenames in os.walk(os.path.realpath(root)):
+        dirnames.sort()
+        if 'header.smbph' in filenames:
+            dirnames[:] = []
+            yield dirpath
+
+
+def file_states(path):
+    """Size and modification time of the files of the blueprint in `path`.
+
+    Returns a dict of file name relative to `path` -> (size, mtime_ns) for
+    the files in `path` and in its DATA directory.
+    """
+    states = {}
+    for directory in ['', 'DATA']:
+        try:
+            entries = list(os.scandir(os.path.join(path, directory)))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                states[os.path.join(directory, entry.name)] = (stat.st_size,
+                                                               stat.st_mtime_ns)
+    return states
+
+
+def content_hash(filename, chunk_size=1 << 20):
+    """CRC32 of a file's content."""
+    crc = 0
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def scan_blueprint(path, meta=False, files=False):
+    """Parse a blueprint into a JSON serializable record.
+
+    A blueprint whose header fails to parse gives a record with an 'error'
+    entry instead of raising. If only the meta file fails, the record keeps
+    the header fields and gets a 'meta_error' entry.
+
+    With `files`, the record has a 'files' entry of file name -> [size,
+    mtime_ns, content_hash], taken before parsing. Only the `HASHED_FILES`
+    are hashed, the hash of the others, like the segment files in DATA, is
+    None.
+    """
+    record = {'path': path}
+    try:
+        if files:
+            record['files'] = {name: [size, mtime, content_hash(os.path.join(path, name))
+                                      if name in HASHED_FILES else None]
+                               for name, (size, mtime) in file_states(path).items()}
+        header = Header.from_file(os.path.join(path, 'header.smbph'), buffered=True)
+        record.update(version=header.version,
+                      type=header.type.name,
+                      bounding_box=[header.xmin, header.ymin, header.zmin,
+                                    header.xmax, header.ymax, header.zmax],
+                      elements=dict(header.elements),
+                      blocks=sum(header.elements.values()))
+    except Exception as e:
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+        return record
+    if meta:
+        try:
+            m = Meta.from_file(os.path.join(path, 'meta.smbpm'), buffered=True)
+            record.update(meta_version=m.version,
+                          docked=len(m.docked or []))
+        except Exception as e:
+            record['meta_error'] = '{}: {}'.format(type(e).__name__, e)
+    return record
+
+
+def scan_catalog(root, meta=False, processes=None, chunksize=16, files=False):
+    """Scan all blueprints below `root` in a pool of `processes` processes.
+
+    Records are yielded in completion order. With `processes=1` everything
+    runs in the calling process.
+    """
+    return scan_blueprints(find_blueprints(root), meta, processes, chunksize, files)
+
+
+def scan_blueprints(paths, meta=False, processes=None, chunksize=16, files=False):
+    """Like `scan_catalog`, for an iterable of blueprint directories."""
+    scan = partial(scan_blueprint, meta=meta, files=files)
+    if processes == 1:
+        for record in map(scan, paths):
+            yield record
+        return
+    with Pool(processes) as pool:
+        for record in pool.imap_unordered(scan, paths, chunksize):
+            yield record
+
+
+class CatalogTotals(object):
+    """Aggregated block counts over a catalog of blueprint records."""
+    def __init__(self):
+        self.blueprints = 0
+        self.errors = 0
+        self.elements = Counter()
+
+    def add(self, record):
+        if 'error' in record:
+            self.errors += 1
+        else:
+            self.blueprints += 1
+            self.elements.update(record['elements'])
+
+    def to_dict(self):
+        return {'blueprints': self.blueprints,
+                'errors': self.errors,
+                'blocks': sum(self.elements.values()),
+                'elements': dict(sorted(self.elements.items()))}
@@ -0,0 +1,151 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+from collections import Counter
+from time import perf_counter
+
+from devtools.blueprint_files import PayloadCodec
+
+
+TYPE_NAMES = {0: 'end', 1: 'int8', 2: 'int16', 3: 'int32', 4: 'int64', 5: 'float',
+              6: 'double', 7: 'bytes', 8: 'string', 9: 'float3', 10: 'int3',
+              11: 'byte3', 12: 'list', 13: 'struct', 14: 'factory', 15: 'float4'}
+
+
+def type_name(type):
+    return TYPE_NAMES.get(type, str(type))
+
+
+class DecodeStats(object):
+    """Counts, bytes and time spent decoding, by payload type and nesting depth.
+
+    Pass an instance as `stats` to `Meta.from_file` or attach it to a parser
+    with `attach`. Only the instrumented parser pays for the bookkeeping.
+
+    Parameters
+    ----------
+    callback: optional callable(type, depth, nbytes, seconds), called after
+              each payload is decoded
+    stacks: also record self-time per stack of payload types, for
+            `write_folded`
+
+    Attributes
+    ----------
+    counts: `Counter` of decoded payloads keyed by (type, depth)
+    bytes, seconds: `Counter`s of bytes and time keyed by (type, depth),
+                    including nested payloads
+    self_bytes, self_seconds: like `bytes` and `seconds`, excluding nested
+                              payloads, so they add up to the totals
+
+    Sections of the meta file outside the tag tree are keyed by their name,
+    e.g. ('docking', 0).
+    """
+    def __init__(self, callback=None, stacks=False):
+        self.callback = callback
+        self.counts = Counter()
+        self.bytes = Counter()
+        self.seconds = Counter()
+        self.self_bytes = Counter()
+        self.self_seconds = Counter()
+        self.folded = Counter()
+        self.depth = 0
+        self._stack = ['meta'] if stacks else None
+        # bytes and seconds of the children of each open payload
+        self._children = [[0, 0.0]]
+
+    def attach(self, stream):
+        """Instrument payload decoding on `stream` and return it."""
+        stream.codecs = [None if codec is None else self._wrap(type, codec)
+                         for type, codec in enumerate(stream.codecs)]
+        return stream
+
+    def _wrap(self, type, codec):
+        decode = codec.decode
+        name = type_name(type)
+        stack, children = self._stack, self._children
+
+        def instrumented(stream):
+            depth = self.depth
+            self.depth = depth + 1
+            if stack is not None:
+                stack.append(name)
+            children.append([0, 0.0])
+            start = stream.tell()
+            t0 = perf_counter()
+            try:
+                data = decode(stream)
+            finally:
+                elapsed = perf_counter() - t0
+                self.depth = depth
+                child_bytes, child_seconds = children.pop()
+                if stack is not None:
+                    self.folded[';'.join(stack)] += elapsed - child_seconds
+                    stack.pop()
+            size = stream.tell() - start
+            children[-1][0] += size
+            children[-1][1] += elapsed
+            key = (type, depth)
+            self.counts[key] += 1
+            self.bytes[key] += size
+            self.seconds[key] += elapsed
+            self.self_bytes[key] += size - child_bytes
+            self.self_seconds[key] += elapsed - child_seconds
+            if self.callback is not None:
+                self.callback(type, depth, size, elapsed)
+            return data
+
+        return PayloadCodec(instrumented, codec.encode)
+
+    def record(self, section, nbytes, seconds):
+        """Record a part of a file decoded outside the payload codecs."""
+        key = (section, 0)
+        for counter, value in [(self.counts, 1), (self.bytes, nbytes),
+                               (self.seconds, seconds), (self.self_bytes, nbytes),
+                               (self.self_seconds, seconds)]:
+            counter[key] += value
+        if self._stack is not None:
+            self.folded[';'.join(self._stack + [section])] += seconds
+
+    def by_type(self):
+        """dict of type -> (count, self bytes, self seconds), summed over all depths."""
+        result = {}
+        for (type, depth), count in self.counts.items():
+            c, b, s = result.get(type, (0, 0, 0.0))
+            result[type] = (c + count, b + self.self_bytes[type, depth],
+                            s + self.self_seconds[type, depth])
+        return result
+
+    def total_seconds(self):
+        return sum(self.self_seconds.values())
+
+    def report(self):
+        """Table of counts, bytes and time by type and depth."""
+        lines = ['{:<16} {:>5} {:>10} {:>12} {:>12}'.format(
+            'type', 'depth', 'count', 'bytes', 'ms')]
+        for key in sorted(self.counts, key=lambda k: (k[1], str(k[0]))):
+            type, depth = key
+            lines.append('{:<16} {:>5} {:>10} {:>12} {:>12.3f}'.format(
+                type_name(type) if isinstance(type, int) else type, depth,
+                self.counts[key], self.bytes[key], self.seconds[key] * 1e3))
+        return '\n'.join(lines)
+
+    def write_folded(self, file):
+        """Write self-times as folded stacks in microseconds, the input format
+        of flamegraph.pl and speedscope. Requires `stacks=True`."""
+        for stack, seconds in sorted(self.folded.items()):
+            file.write('{} {}\n'.format(stack, max(0, int(round(seconds * 1e6)))))
@@ -0,0 +1,180 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import hashlib
+import os
+from collections import Counter
+
+from devtools.blueprint_files import Header, Meta, imap_threaded
+
+
+class DockedBlueprint(object):
+    """A blueprint and the blueprints docked to it.
+
+    Attributes
+    ----------
+    path: blueprint directory
+    entry: `MetaDockedEntry` the blueprint is docked with, None for the root
+    header, meta: the parsed files. Blueprints with identical files share
+                  the same objects.
+    key: SHA-1 of the header and meta files
+    children: docked `DockedBlueprint`s
+    missing: docked entries without header and meta files
+    rejected: docked entries that weren't followed, see `load_docking_tree`
+    """
+    def __init__(self, path, entry=None):
+        self.path = path
+        self.entry = entry
+        self.header = None
+        self.meta = None
+        self.key = None
+        self.children = []
+        self.missing = []
+        self.rejected = []
+
+    def walk(self):
+        """Yield (blueprint, offset) for this blueprint and all blueprints
+        docked to it, where offset is the summed docking position relative
+        to this blueprint."""
+        stack = [(self, (0, 0, 0))]
+        while stack:
+            node, offset = stack.pop()
+            yield node, offset
+            for child in reversed(node.children):
+                stack.append((child, tuple(o + p for o, p in zip(offset, child.entry.pos))))
+
+    def element_counts(self):
+        """`Counter` of block id -> count over the whole assembly."""
+        counts = Counter()
+        for node, _ in self.walk():
+            counts.update(node.header.elements)
+        return counts
+
+    def bounding_box(self):
+        """(xmin, ymin, zmin, xmax, ymax, zmax) of the whole assembly.
+
+        Docked blueprints are moved by their docking positions. Their
+        orientation is not applied.
+        """
+        box = None
+        for node, (x, y, z) in self.walk():
+            h = node.header
+            corners = (h.xmin + x, h.ymin + y, h.zmin + z, h.xmax + x, h.ymax + y, h.zmax + z)
+            if box is None:
+                box = corners
+            else:
+                box = (tuple(map(min, box[:3], corners[:3])) +
+                       tuple(map(max, box[3:], corners[3:])))
+        return box
+
+    def __len__(self):
+        return sum(1 for _ in self.walk())
+
+    def __repr__(self):
+        return "DockedBlueprint(path={}, children={})".format(self.path, len(self.children))
+
+
+def _read_blueprint(path):
+    with open(os.path.join(path, 'header.smbph'), 'rb') as file:
+        header = file.read()
+    with open(os.path.join(path, 'meta.smbpm'), 'rb') as file:
+        meta = file.read()
+    # the length keeps the boundary between the two files in the key
+    key = hashlib.sha1(len(header).to_bytes(8, 'big'))
+    key.update(header)
+    key.update(meta)
+    return key.hexdigest(), header, meta
+
+
+def _docked_path(parent, name):
+    """Real path of the directory `name` docked in `parent`, or None if
+    `name` isn't a single directory name or leads out of `parent`."""
+    if not name or name in (os.curdir, os.pardir) or os.sep in name or \
+            (os.altsep and os.altsep in name) or os.path.isabs(name):
+        return None
+    path = os.path.realpath(os.path.join(parent, name))
+    if path == parent or os.path.commonpath([parent, path]) != parent:
+        return None
+    return path
+
+
+def _parse_blueprint(files):
+    header, meta = files
+    return Header.from_buffer(header), Meta.from_buffer(meta)
+
+
+def load_docking_tree(path, workers=None, cache=None, max_depth=32):
+    """Load a blueprint and, following `Meta.docked` into its ATTACHED_*
+    directories, every blueprint docked to it.
+
+    Each level of the docking tree is read in a pool of `workers` threads.
+    Blueprints are keyed by a hash of their header and meta files, and
+    only the first one of each key is parsed.
+
+    The names in meta files are not trusted: an entry is only followed if
+    its name is a single directory name whose real path lies inside the
+    directory of the blueprint it is docked to, that directory wasn't
+    loaded already, and the tree is less than `max_depth` levels deep.
+    Other entries end up in `rejected`.
+
+    Parameters
+    ----------
+    path: blueprint directory
+    workers: number of threads, see `concurrent.futures.ThreadPoolExecutor`
+    cache: optional dict of key -> (`Header`, `Meta`), shared between calls
+           to parse identical blueprints only once across assemblies
+    max_depth: number of docking levels to follow below the root
+
+    Returns the root `DockedBlueprint`.
+    """
+    if cache is None:
+        cache = {}
+    root = DockedBlueprint(path)
+    real = {root: os.path.realpath(path)}
+    visited = set(real.values())
+    level = [root]
+    depth = 0
+    while level:
+        files = {}
+        for node, (key, header, meta) in zip(level, imap_threaded(
+                _read_blueprint, [node.path for node in level], workers)):
+            node.key = key
+            if key not in cache:
+                files[key] = header, meta
+        for key, parsed in zip(files, imap_threaded(_parse_blueprint, files.values(), workers)):
+            cache[key] = parsed
+        next_level = []
+        for node in level:
+            node.header, node.meta = cache[node.key]
+            for entry in node.meta.docked or []:
+                child_path = _docked_path(real[node], entry.name)
+                if child_path is None or child_path in visited or depth >= max_depth:
+                    node.rejected.append(entry)
+                    continue
+                if not all(os.path.isfile(os.path.join(child_path, name))
+                           for name in ('header.smbph', 'meta.smbpm')):
+                    node.missing.append(entry)
+                    continue
+                visited.add(child_path)
+                child = DockedBlueprint(os.path.join(node.path, entry.name), entry)
+                real[child] = child_path
+                node.children.append(child)
+            next_level.extend(node.children)
+        level = next_level
+        depth += 1
+    return root
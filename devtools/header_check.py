@@ -0,0 +1,130 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+from collections import namedtuple
+
+from devtools.blueprint_files import Header, Segment, load_segments
+from devtools.histogram import ElementHistogram
+
+
+# Differences between a stored header and the segment data.
+# `elements` is a dict of block id -> (stored, counted) for the ids whose
+# counts differ, `bounding_box` is (stored, computed) or None if they match.
+#
+# The bounding box convention (block coordinates from the segment positions,
+# the maximum one past the largest block) has not been checked against
+# headers written by the game, so box differences are only reported, never
+# rewritten.
+HeaderDiff = namedtuple('HeaderDiff', ['elements', 'bounding_box'])
+
+
+def segment_extent(ids):
+    """(xmin, ymin, zmin, xmax, ymax, zmax) of the non-empty blocks in
+    `ids`, the block ids of a segment, or None if it is empty.
+
+    Planes, rows and block runs are tested as raw bytes, so there is no
+    Python loop over single blocks.
+    """
+    raw = ids.tobytes()
+    n = Segment.size
+    row = len(raw) // (n * n)
+    plane = row * n
+    zero_row = bytes(row)
+    zero_plane = bytes(plane)
+    zs = [z for z in range(n) if raw[z * plane:(z + 1) * plane] != zero_plane]
+    if not zs:
+        return None
+    ys = set()
+    xmin, xmax = n, -1
+    for z in zs:
+        for y in range(n):
+            start = z * plane + y * row
+            data = raw[start:start + row]
+            if data != zero_row:
+                ys.add(y)
+                xmin = min(xmin, (row - len(data.lstrip(b'\0'))) // 2)
+                xmax = max(xmax, (len(data.rstrip(b'\0')) - 1) // 2)
+    return xmin, min(ys), zs[0], xmax, max(ys), zs[-1]
+
+
+def scan_segments(path, workers=None):
+    """Count the blocks of the blueprint in directory `path` from its segments.
+
+    Segments are inflated in a pool of `workers` threads and dropped once
+    counted, so memory use doesn't grow with the size of the blueprint.
+
+    Returns (`ElementHistogram`, bounding box), where the bounding box spans
+    the block coordinates of all non-empty blocks, from the smallest ones
+    to one past the largest ones, or is None without blocks. See
+    `HeaderDiff` about this convention.
+    """
+    elements = ElementHistogram()
+    box = None
+    for segment in load_segments(path, workers=workers, ordered=False):
+        ids = segment.ids()
+        extent = segment_extent(ids)
+        if extent is None:
+            continue
+        elements.add_ids(ids)
+        x, y, z = segment.position
+        extent = (extent[0] + x, extent[1] + y, extent[2] + z,
+                  extent[3] + x + 1, extent[4] + y + 1, extent[5] + z + 1)
+        if box is None:
+            box = extent
+        else:
+            box = tuple(map(min, box[:3], extent[:3])) + tuple(map(max, box[3:], extent[3:]))
+    elements[0] = 0
+    return elements, box
+
+
+def _diff(header, elements, box):
+    ids = set(header.elements) | set(elements)
+    changed = {id: (header.elements.get(id, 0), elements[id]) for id in sorted(ids)
+               if header.elements.get(id, 0) != elements[id]}
+    stored = (header.xmin, header.ymin, header.zmin, header.xmax, header.ymax, header.zmax)
+    if box is None:
+        box = (0,) * 6
+    # the stored box is float; anything closer than half a block is the same block
+    same = all(abs(s - b) < 0.5 for s, b in zip(stored, box))
+    return HeaderDiff(changed, None if same else (stored, box))
+
+
+def verify_header(path, workers=None):
+    """Compare header.smbph of the blueprint in `path` with its segments.
+
+    Returns a `HeaderDiff`, with nothing in it if the header is up to date.
+    """
+    header = Header.from_file(os.path.join(path, 'header.smbph'))
+    return _diff(header, *scan_segments(path, workers))
+
+
+def rebuild_header(path, workers=None):
+    """Like `verify_header`, but also write header.smbph with the counted
+    elements if they differ from the stored ones.
+
+    The stored bounding box is kept as it is, see `HeaderDiff`.
+    """
+    filename = os.path.join(path, 'header.smbph')
+    header = Header.from_file(filename)
+    elements, box = scan_segments(path, workers)
+    diff = _diff(header, elements, box)
+    if diff.elements:
+        header.elements = elements.to_dict()
+        header.to_file(filename)
+    return diff
@@ -0,0 +1,234 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import struct
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ElementHistogram(object):
+    """Block counts with arithmetic for aggregating many blueprints.
+
+    Behaves like the dict of block id -> count used for `Header.elements`:
+    iterating yields the ids with a non-zero count in ascending order.
+    The counts are kept in a NumPy array indexed by block id if NumPy is
+    available, otherwise in a dict.
+
+    Parameters
+    ----------
+    elements: optional mapping of block id -> count
+    use_numpy: force (True) or avoid (False) the NumPy backend
+    dense: without NumPy, keep the counts in an `array('q')` indexed by
+           block id instead of a dict. That is more compact if most ids up
+           to the largest one are used, but several times slower to update.
+    """
+    record_format = struct.Struct('>HI')
+
+    def __init__(self, elements=None, use_numpy=None, dense=False):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy
+        self.backend = 'numpy' if use_numpy else 'array' if dense else 'dict'
+        self.counts = self._zeros(0)
+        if elements:
+            self.resize(max(elements) + 1)
+            for id, count in elements.items():
+                self[id] = count
+
+    def _zeros(self, size):
+        if self.backend == 'numpy':
+            return numpy.zeros(size, numpy.int64)
+        if self.backend == 'array':
+            return array('q', bytes(8 * size))
+        return {}
+
+    def _empty(self):
+        return ElementHistogram(use_numpy=self.use_numpy, dense=self.backend == 'array')
+
+    def resize(self, size):
+        """Make room for block ids below `size`."""
+        if self.backend == 'dict':
+            return
+        if size > len(self.counts):
+            if self.backend == 'numpy':
+                self.counts = numpy.concatenate([self.counts,
+                                                 self._zeros(size - len(self.counts))])
+            else:
+                self.counts.extend(self._zeros(size - len(self.counts)))
+
+    @staticmethod
+    def from_records(data, use_numpy=None, dense=False):
+        """Build from packed big-endian (uint16 id, uint32 count) records,
+        as stored in header.smbph."""
+        histogram = ElementHistogram(use_numpy=use_numpy, dense=dense)
+        if histogram.backend == 'numpy':
+            records = numpy.frombuffer(data, [('id', '>u2'), ('count', '>u4')])
+            if len(records):
+                histogram.resize(int(records['id'].max()) + 1)
+                numpy.add.at(histogram.counts, records['id'], records['count'])
+        else:
+            for id, count in ElementHistogram.record_format.iter_unpack(data):
+                histogram[id] = histogram[id] + count
+        return histogram
+
+    def __getitem__(self, id):
+        if self.backend == 'dict':
+            return self.counts.get(id, 0)
+        if id < len(self.counts):
+            return int(self.counts[id])
+        return 0
+
+    def __setitem__(self, id, count):
+        if self.backend == 'dict':
+            if count:
+                self.counts[id] = count
+            else:
+                self.counts.pop(id, None)
+            return
+        self.resize(id + 1)
+        self.counts[id] = count
+
+    def __iter__(self):
+        if self.backend == 'dict':
+            return iter(sorted(self.counts))
+        if self.backend == 'numpy':
+            return iter(numpy.flatnonzero(self.counts).tolist())
+        return (id for id, count in enumerate(self.counts) if count)
+
+    def __len__(self):
+        if self.backend == 'dict':
+            return len(self.counts)
+        if self.backend == 'numpy':
+            return int(numpy.count_nonzero(self.counts))
+        return len(self.counts) - self.counts.count(0)
+
+    def __contains__(self, id):
+        return self[id] != 0
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[id] for id in self]
+
+    def items(self):
+        if self.backend == 'dict':
+            return sorted(self.counts.items())
+        return [(id, self[id]) for id in self]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def total(self):
+        if self.backend == 'numpy':
+            return int(self.counts.sum())
+        if self.backend == 'dict':
+            return sum(self.counts.values())
+        return sum(self.counts)
+
+    def copy(self):
+        result = self._empty()
+        result.counts = self.counts[:] if self.backend == 'array' else self.counts.copy()
+        return result
+
+    def add(self, other, factor=1):
+        """Add `factor` times the counts of `other`, a histogram or mapping, in place."""
+        if isinstance(other, ElementHistogram) and self.backend == 'numpy' and \
+                other.backend == 'numpy':
+            self.resize(len(other.counts))
+            self.counts[:len(other.counts)] += factor * other.counts
+        elif self.backend == 'dict':
+            counts = self.counts
+            for id, count in other.items():
+                count = counts.get(id, 0) + factor * count
+                if count:
+                    counts[id] = count
+                else:
+                    counts.pop(id, None)
+        else:
+            items = other.items()
+            if items:
+                self.resize(max(items)[0] + 1)
+            counts = self.counts
+            for id, count in items:
+                counts[id] += factor * count
+        return self
+
+    def add_ids(self, ids):
+        """Count every block id in `ids`, an `array('H')` such as
+        `Segment.ids()`, in place."""
+        if self.backend == 'numpy':
+            counts = numpy.bincount(numpy.frombuffer(ids, numpy.uint16))
+            self.resize(len(counts))
+            self.counts[:len(counts)] += counts
+        else:
+            self.add(Counter(ids))
+        return self
+
+    def sub(self, other):
+        return self.add(other, -1)
+
+    def scale(self, factor):
+        """Multiply all counts by the integer `factor`, in place."""
+        if self.backend == 'numpy':
+            self.counts *= factor
+        elif self.backend == 'dict':
+            self.counts = {id: count * factor for id, count in self.counts.items()
+                           if count * factor}
+        else:
+            self.counts = array('q', (count * factor for count in self.counts))
+        return self
+
+    def __add__(self, other):
+        return self.copy().add(other)
+
+    def __sub__(self, other):
+        return self.copy().sub(other)
+
+    def __mul__(self, factor):
+        return self.copy().scale(factor)
+
+    __rmul__ = __mul__
+    __iadd__ = add
+    __isub__ = sub
+
+    def __eq__(self, other):
+        try:
+            return self.to_dict() == {id: count for id, count in other.items() if count}
+        except AttributeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    @staticmethod
+    def sum(histograms, use_numpy=None, dense=False):
+        """Aggregate an iterable of histograms or mappings in one pass."""
+        result = ElementHistogram(use_numpy=use_numpy, dense=dense)
+        for histogram in histograms:
+            result.add(histogram)
+        return result
+
+    def __repr__(self):
+        return 'ElementHistogram({})'.format(self.to_dict())
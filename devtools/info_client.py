@@ -0,0 +1,57 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+
+    Client for `devtools.info_server`. It imports nothing but the standard
+    library socket and json modules, so connecting is cheap.
+"""
+
+import json
+import socket
+
+
+class InfoClient(object):
+    """Connection to an `InfoServer`."""
+    def __init__(self, address):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, command, **args):
+        """Send a command and return its result.
+
+        Raises RuntimeError with the server's message if the command failed.
+        """
+        args['command'] = command
+        self.file.write(json.dumps(args).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise RuntimeError('connection closed by server')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
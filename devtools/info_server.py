@@ -0,0 +1,162 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+
+    Blueprint information served over a Unix socket, so repeated queries
+    don't pay for interpreter startup and parsing the block config.
+
+    Protocol: the client sends one JSON object per line, e.g.
+    {"command": "header", "path": "blueprints/MyShip"}, and gets one JSON
+    object per line back, {"result": ...} or {"error": "..."}. Commands:
+
+    header    version, entity type, bounding box and block counts
+    meta      version, tag root version and docked entries
+    inventory block counts and bounding box including all docked entities
+    ping      "pong"
+
+    Block counts are [block id, count, name] lists, and "named" tells if
+    the server has a block config to fill in the names.
+
+    The client is `devtools.info_client.InfoClient`.
+"""
+
+import json
+import os
+import socketserver
+import threading
+
+from devtools.block_config import BlockConfig
+from devtools.blueprint_files import Header, Meta
+from devtools.docking import load_docking_tree
+
+
+class WarmBlockConfig(object):
+    """`BlockConfig` that is parsed again when its files change.
+
+    Parameters
+    ----------
+    starmade: path to Starmade, or None to serve block ids without names
+    cachedir: see `BlockConfig`
+    """
+    def __init__(self, starmade=None, cachedir=None):
+        self.files = None
+        if starmade is not None:
+            self.files = (os.path.join(starmade, 'data/config/BlockTypes.properties'),
+                          os.path.join(starmade, 'data/config/BlockConfig.xml'))
+        self.cachedir = cachedir
+        self.config = None
+        self.loads = 0
+        self._state = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current `BlockConfig`, or None without Starmade."""
+        if self.files is None:
+            return None
+        state = [(stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, self.files)]
+        with self._lock:
+            if state != self._state:
+                self.config = BlockConfig(*self.files, cachedir=self.cachedir)
+                self._state = state
+                self.loads += 1
+            return self.config
+
+
+def element_list(elements, config):
+    """[[block id, count, name or None], ...] sorted by block id."""
+    blocks = {} if config is None else config.blocks
+    return [[id, count, blocks[id].name if id in blocks else None]
+            for id, count in sorted(elements.items())]
+
+
+def header_info(path, config):
+    header = Header.from_file(os.path.join(path, 'header.smbph'), buffered=True)
+    return {'version': header.version,
+            'type': header.type.name,
+            'bounding_box': [header.xmin, header.ymin, header.zmin,
+                             header.xmax, header.ymax, header.zmax],
+            'elements': element_list(header.elements, config),
+            'blocks': sum(header.elements.values()),
+            'named': config is not None}
+
+
+def meta_info(path, config):
+    meta = Meta.from_file(os.path.join(path, 'meta.smbpm'), buffered=True)
+    return {'version': meta.version,
+            'tag_version': None if meta.tags is None else meta.tags.version,
+            'docked': [{'name': d.name, 'pos': list(d.pos), 'size': list(d.size),
+                        'style': d.style, 'orientation': d.orientation}
+                       for d in meta.docked or []]}
+
+
+def inventory_info(path, config):
+    tree = load_docking_tree(path)
+    elements = tree.element_counts()
+    return {'entities': len(tree),
+            'missing': sum(len(node.missing) for node, _ in tree.walk()),
+            'rejected': sum(len(node.rejected) for node, _ in tree.walk()),
+            'bounding_box': list(tree.bounding_box()),
+            'elements': element_list(elements, config),
+            'blocks': sum(elements.values()),
+            'named': config is not None}
+
+
+COMMANDS = {'header': header_info, 'meta': meta_info, 'inventory': inventory_info}
+
+
+class InfoRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                command = request.get('command')
+                if command == 'ping':
+                    response = {'result': 'pong'}
+                elif command in COMMANDS:
+                    response = {'result': COMMANDS[command](request['path'],
+                                                            self.server.config.get())}
+                else:
+                    response = {'error': 'unknown command: {}'.format(command)}
+            except Exception as e:
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class InfoServer(socketserver.ThreadingUnixStreamServer):
+    """Serve blueprint information on the Unix socket `address`.
+
+    Any stale socket file at `address` is replaced. Call `serve_forever`
+    to run and `server_close` to remove the socket.
+
+    Parameters
+    ----------
+    address: path of the Unix socket
+    starmade, cachedir: see `WarmBlockConfig`
+    """
+    daemon_threads = True
+
+    def __init__(self, address, starmade=None, cachedir=None):
+        self.config = WarmBlockConfig(starmade, cachedir)
+        self.config.get()
+        if os.path.exists(address):
+            os.remove(address)
+        socketserver.ThreadingUnixStreamServer.__init__(self, address, InfoRequestHandler)
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,144 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+
+    Generators for synthetic blueprints of configurable size, used by the
+    benchmarks and tests.
+"""
+
+import os
+import random
+from array import array
+
+from devtools.blueprint_files import EntityTypes, Header, Meta, MetaDockedEntry
+from devtools.blueprint_files import Payload, Segment, SegmentFile, Tag, TagList
+from devtools.blueprint_files import TagRoot, TagStruct
+
+
+def synthetic_header(n_elements, seed=0):
+    """Header with `n_elements` distinct block ids."""
+    rng = random.Random(seed)
+    ids = rng.sample(range(1, 65536), n_elements)
+    elements = {id: rng.randrange(1, 100000) for id in ids}
+    return Header(0, EntityTypes.station, -100, -50, -200, 100, 50, 200, elements)
+
+
+def _leaf(rng, bytearray_size=0, type=None):
+    if type is None:
+        type = rng.choice([1, 2, 3, 4, 5, 6, 8, 9, 10, 11, 15])
+    if type in [1, 11]:
+        data = rng.randrange(-128, 128) if type == 1 else tuple(
+            rng.randrange(-128, 128) for _ in range(3))
+    elif type == 2:
+        data = rng.randrange(-2 ** 15, 2 ** 15)
+    elif type in [3, 10]:
+        data = rng.randrange(-2 ** 31, 2 ** 31) if type == 3 else tuple(
+            rng.randrange(-2 ** 31, 2 ** 31) for _ in range(3))
+    elif type == 4:
+        data = rng.randrange(-2 ** 63, 2 ** 63)
+    elif type == 8:
+        data = 'value{}'.format(rng.randrange(1000))
+    else:
+        # floats that survive the round trip through single precision
+        n = {5: 1, 6: 1, 9: 3, 15: 4}[type]
+        data = tuple(rng.randrange(-2 ** 20, 2 ** 20) / 64.0 for _ in range(n))
+        if n == 1:
+            data = data[0]
+    if bytearray_size and rng.random() < 0.05:
+        type, data = 7, bytes(bytearray(rng.getrandbits(8) for _ in range(bytearray_size)))
+    return Payload(type, data)
+
+
+def synthetic_tag(depth, breadth, list_length=16, bytearray_size=0, seed=0):
+    """Tree of nested `TagStruct`s and `TagList`s.
+
+    Parameters
+    ----------
+    depth: nesting depth of the struct tree
+    breadth: number of tags per struct
+    list_length: number of elements of each `TagList`
+    bytearray_size: size of the occasional `ByteArray` leaf, 0 for none
+    """
+    rng = random.Random(seed)
+
+    def make(level):
+        tags = []
+        for i in range(breadth):
+            name = 'tag{}'.format(i) if rng.random() < 0.5 else None
+            if level < depth and i % 3 == 0:
+                payload = Payload(13, make(level + 1))
+            elif i % 3 == 1:
+                type = rng.choice([3, 5, 9])
+                payload = Payload(12, TagList(type, [_leaf(rng, type=type)
+                                                     for _ in range(list_length)]))
+            else:
+                payload = _leaf(rng, bytearray_size)
+            tags.append(Tag(name, payload))
+        return TagStruct(tags)
+
+    return Tag(None, Payload(13, make(1)))
+
+
+def synthetic_meta(depth, breadth, n_docked=0, list_length=16, bytearray_size=0,
+                   compressed=False, seed=0):
+    """Meta with a synthetic tag tree and `n_docked` docked entries."""
+    rng = random.Random(seed)
+    docked = [MetaDockedEntry('ATTACHED_{}'.format(i),
+                              [rng.randrange(-100, 100) for _ in range(3)],
+                              [1.0, 2.0, 3.0], rng.randrange(100), rng.randrange(24))
+              for i in range(n_docked)]
+    tag = synthetic_tag(depth, breadth, list_length, bytearray_size, seed)
+    version = TagRoot.compressed_version if compressed else 0
+    return Meta(0, docked, TagRoot(version, tag))
+
+
+def synthetic_segment(position, n_blocks=2000, fill=5, seed=0):
+    """Segment filled with `fill` plus `n_blocks` random other blocks."""
+    rng = random.Random(seed)
+    blocks = array('I', [fill] * Segment.n_blocks)
+    for _ in range(n_blocks):
+        blocks[rng.randrange(Segment.n_blocks)] = rng.randrange(1, 2048)
+    return Segment(position, blocks)
+
+
+def synthetic_station(path, n_regions, n_segments, seed=0):
+    """Write region files with `n_segments` segments each to `path`/DATA."""
+    rng = random.Random(seed)
+    data = os.path.join(path, 'DATA')
+    if not os.path.isdir(data):
+        os.makedirs(data)
+    for r in range(n_regions):
+        segments = {}
+        for i in range(n_segments):
+            position = (32 * (i % 16), 32 * (i // 16 % 16), 32 * (i // 256) + 512 * r)
+            segments[i] = synthetic_segment(position, seed=rng.random())
+        SegmentFile.to_file(os.path.join(data, 'station.0.0.{}.smd2'.format(r)), segments)
+
+
+def count_tags(tag):
+    """Number of tags and list elements in a tag tree."""
+    count = 1
+    stack = [tag.payload]
+    while stack:
+        payload = stack.pop()
+        if payload.type == 13:
+            count += len(payload.data.tags)
+            stack.extend(t.payload for t in payload.data.tags)
+        elif payload.type == 12:
+            count += len(payload.data.list)
+            if payload.data.type == 12 or payload.data.type == 13:
+                stack.extend(payload.data.list)
+    return count
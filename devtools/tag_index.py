@@ -0,0 +1,424 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from devtools.blueprint_files import BinBufferParser, Meta, MetaDockedEntry, Payload
+from devtools.blueprint_files import String, Tag, TagList, TagRoot, TagStruct, TagTypes
+from devtools.blueprint_files import TypedTagList
+from devtools.blueprint_files import _swap_big_endian, decode_payload, decode_tag, write_atomic
+
+
+class TagIndex(object):
+    """Byte ranges of the tags of a meta.smbpm tag tree.
+
+    Pass an instance as `index` to `Meta.from_file` to fill it while the file
+    is decoded. Keep it with `to_file` and `from_file`, and use `open` to
+    get the tag tree back without decoding the file again.
+
+    There is one entry per tag, and one per struct or list that is an
+    element of a list, in the order they appear in the file. Entry `i`
+    covers `lengths[i]` bytes from `offsets[i]` and is followed by its
+    descendants, up to entry `ends[i]`. Offsets are positions in the file,
+    or in the inflated data for compressed tag roots. Tag entries start at
+    the type byte, list element entries at the payload.
+
+    Attributes
+    ----------
+    offsets: `array('Q')` of entry offsets
+    lengths, ends: `array('I')` of entry sizes and of the entry after the
+                   last descendant
+    version: version of the `TagRoot`
+    data_offset: file position of the tag data
+    source: (size, mtime_ns) of the indexed file, or None if unknown
+    """
+    header_format = struct.Struct('>4sHHQqqI')
+    file_magic = b'SMTI'
+    file_version = 1
+
+    def __init__(self):
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.ends = array('I')
+        self.version = 0
+        self.data_offset = 0
+        self.source = None
+
+    def set_source(self, filename):
+        stat = os.stat(filename)
+        self.source = (stat.st_size, stat.st_mtime_ns)
+
+    def set_root(self, version, data_offset):
+        """Start indexing the tag root of `version` at `data_offset`."""
+        self.version = version
+        self.data_offset = data_offset
+        del self.offsets[:], self.lengths[:], self.ends[:]
+
+    def begin(self, offset):
+        """Add an entry starting at `offset` and return its number."""
+        self.offsets.append(offset)
+        self.lengths.append(0)
+        self.ends.append(0)
+        return len(self.offsets) - 1
+
+    def end(self, entry, offset):
+        """Close `entry` at `offset`, after all of its descendants."""
+        self.lengths[entry] = offset - self.offsets[entry]
+        self.ends[entry] = len(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def children(self, entry):
+        """Entry numbers of the direct children of `entry`."""
+        ends = self.ends
+        child = entry + 1
+        while child < ends[entry]:
+            yield child
+            child = ends[child]
+
+    def is_current(self, filename):
+        """False if `filename` changed since it was indexed."""
+        if self.source is None:
+            return True
+        stat = os.stat(filename)
+        return self.source == (stat.st_size, stat.st_mtime_ns)
+
+    def open(self, filename):
+        """Tag tree of the indexed file with lazily decoded structs.
+
+        The file is memory-mapped, or inflated into memory once for
+        compressed tag roots. The tags of a struct are decoded the first time
+        its `tags` are accessed, with struct payloads again as proxies.
+
+        Raises ValueError if the file changed since it was indexed.
+        """
+        if not self.is_current(filename):
+            raise ValueError('tag index of {} is out of date'.format(filename))
+        with open(filename, 'rb') as file:
+            stream = BinBufferParser.from_file(file)
+        if self.version == TagRoot.compressed_version:
+            inflater = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            stream = BinBufferParser(inflater.decompress(stream.view[self.data_offset:]))
+        return IndexedTags(self, stream).tag(0)
+
+    def to_file(self, filename):
+        write_atomic(filename, self.to_bytes())
+
+    def to_bytes(self):
+        size, mtime_ns = self.source if self.source is not None else (-1, -1)
+        header = TagIndex.header_format.pack(TagIndex.file_magic, TagIndex.file_version,
+                                             self.version, self.data_offset, size,
+                                             mtime_ns, len(self))
+        return b''.join([header] + [_swap_big_endian(array(a.typecode, a)).tobytes()
+                                    for a in (self.offsets, self.lengths, self.ends)])
+
+    @staticmethod
+    def from_file(filename):
+        with open(filename, 'rb') as file:
+            return TagIndex.from_bytes(file.read())
+
+    @staticmethod
+    def from_bytes(data):
+        stream = BinBufferParser(data)
+        magic, file_version, version, data_offset, size, mtime_ns, n = \
+            stream.get(TagIndex.header_format)
+        if magic != TagIndex.file_magic or file_version != TagIndex.file_version:
+            raise ValueError('not a tag index of version {}'.format(TagIndex.file_version))
+        index = TagIndex()
+        index.version = version
+        index.data_offset = data_offset
+        index.source = None if size < 0 else (size, mtime_ns)
+        for a in (index.offsets, index.lengths, index.ends):
+            a.frombytes(stream.get_bytes(n * a.itemsize))
+            _swap_big_endian(a)
+        return index
+
+
+class IndexedTags(object):
+    """Decode entries of a `TagIndex` from a `BinBufferParser` of the file,
+    or of the inflated tag data."""
+    def __init__(self, index, stream):
+        self.index = index
+        self.stream = stream
+
+    def tag(self, entry):
+        """Tag of a tag entry, with lazy struct payloads."""
+        stream = self.stream
+        stream.offset = self.index.offsets[entry]
+        type = stream.get_one(Tag.type_format)
+        name = sys.intern(String.deserialize(stream)) if type > 0 else None
+        return Tag(name, self.payload(entry, abs(type), stream.offset))
+
+    def payload(self, entry, type, offset):
+        """Payload of `type` at `offset` that belongs to `entry`, with lazy
+        struct payloads."""
+        if type == 13:
+            return Payload(13, LazyTagStruct(self, entry, offset))
+        stream = self.stream
+        stream.offset = offset
+        if type == 12:
+            element_type, length = stream.get(TagList.header_format)
+            if element_type == 12 or element_type == 13:
+                offsets = self.index.offsets
+                items = [self.payload(child, element_type, offsets[child])
+                         for child in self.index.children(entry)]
+            else:
+                stream.offset = offset
+                payload = decode_payload(stream, type)
+                if isinstance(payload.data, TypedTagList):
+                    return Payload(12, RawTypedTagList(element_type, payload.data.values,
+                                                       self, entry, offset))
+                items = payload.data.list
+            return Payload(12, RawTagList(element_type, items, self, entry, offset))
+        return decode_payload(stream, type)
+
+    def decode(self, entry):
+        """Fully decoded `Tag` of a tag entry."""
+        self.stream.offset = self.index.offsets[entry]
+        return decode_tag(self.stream)
+
+    def span(self, entry):
+        """(start, end) of the bytes of `entry`."""
+        start = self.index.offsets[entry]
+        return start, start + self.index.lengths[entry]
+
+    def raw(self, pieces):
+        """Replace the (start, end) ranges in `pieces` by slices of the data,
+        merging adjacent ranges into one slice."""
+        view = self.stream.view
+        start = end = None
+        for piece in pieces:
+            if isinstance(piece, tuple):
+                if piece[0] == end:
+                    end = piece[1]
+                    continue
+                if start is not None:
+                    yield view[start:end]
+                start, end = piece
+            else:
+                if start is not None:
+                    yield view[start:end]
+                    start = end = None
+                yield piece
+        if start is not None:
+            yield view[start:end]
+
+
+class LazyTagStruct(TagStruct):
+    """`TagStruct` whose tags are decoded from an `IndexedTags` on first
+    access.
+
+    When written with `encode_tag`, the original bytes are copied for the
+    struct if it is unchanged, and otherwise for every tag of it that still
+    has its original name, payload and data.
+    """
+    __slots__ = ('source', 'entry', 'offset', '_tags', '_original', '_dirty')
+
+    def __init__(self, source, entry, offset):
+        self.source = source
+        self.entry = entry
+        self.offset = offset
+        self._tags = None
+        # id of each decoded tag -> (tag, name, payload, type, data, entry)
+        self._original = None
+        # set when `tags` is assigned, the original bytes are no longer valid
+        self._dirty = False
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            source = self.source
+            children = list(source.index.children(self.entry))
+            self._tags = [source.tag(child) for child in children]
+            self._original = {id(tag): (tag, tag.name, tag.payload, tag.payload.type,
+                                        tag.payload.data, child)
+                              for tag, child in zip(self._tags, children)}
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags
+        self._dirty = True
+        if self._original is None:
+            self._original = {}
+
+    def _original_tag(self, tag):
+        """(payload, entry) of `tag` if it is one of the decoded tags with its
+        original name, payload and data, else None."""
+        before = self._original.get(id(tag))
+        if before is None:
+            return None
+        original, name, payload, type, data, entry = before
+        if original is not tag or tag.name != name or tag.payload is not payload or \
+                payload.type != type or payload.data is not data:
+            return None
+        return payload, entry
+
+    def untouched(self):
+        """True if writing the struct gives its original bytes."""
+        if self._dirty:
+            return False
+        if self._tags is None:
+            return True
+        if len(self._tags) != len(self._original):
+            return False
+        previous = -1
+        for tag in self._tags:
+            original = self._original_tag(tag)
+            if original is None or original[1] <= previous:
+                return False
+            payload, previous = original
+            if (payload.type == 12 or payload.type == 13) and not payload.data.untouched():
+                return False
+        return True
+
+    def pieces(self):
+        """Tags and original byte ranges to write, see `encode_tag`."""
+        end = self.source.span(self.entry)[1]
+        if self.untouched():
+            return self.source.raw([(self.offset, end)])
+        return self.source.raw(self._pieces(end))
+
+    def _pieces(self, end):
+        span = self.source.span
+        for tag in self._tags:
+            original = self._original_tag(tag)
+            if original is None:
+                yield tag
+                continue
+            payload, entry = original
+            if (payload.type == 12 or payload.type == 13) and not payload.data.untouched():
+                yield span(entry)[0], payload.data.offset
+                yield payload
+            else:
+                yield span(entry)
+        # end tag
+        yield end - 1, end
+
+
+class RawTagList(TagList):
+    """`TagList` decoded from an `IndexedTags`.
+
+    When written with `encode_tag`, it is copied from the original bytes as
+    long as its elements are the original ones with their original data,
+    and so are the struct and list elements that are unchanged.
+    """
+    __slots__ = ('source', 'entry', 'offset', '_type', '_list', '_data')
+
+    def __init__(self, type, tl, source, entry, offset):
+        TagList.__init__(self, type, tl)
+        self.source = source
+        self.entry = entry
+        self.offset = offset
+        self._type = type
+        self._list = tuple(tl)
+        self._data = tuple(payload.data for payload in tl)
+
+    def untouched(self):
+        if self.type != self._type or tuple(self.list) != self._list or \
+                tuple(payload.data for payload in self.list) != self._data:
+            return False
+        if self.type == 12 or self.type == 13:
+            return all(data.untouched() for data in self._data)
+        return True
+
+    def pieces(self):
+        """Payloads and original byte ranges to write, see `encode_tag`."""
+        if self.untouched():
+            return self.source.raw([(self.offset, self.source.span(self.entry)[1])])
+        return self.source.raw(self._pieces())
+
+    def _pieces(self):
+        yield TagList.header_format.pack(self.type, len(self.list))
+        if self.type != 12 and self.type != 13:
+            for payload in self.list:
+                yield payload
+            return
+        original = {id(payload): data for payload, data in zip(self._list, self._data)}
+        for payload in self.list:
+            data = original.get(id(payload))
+            if data is not None and payload.data is data and data.untouched():
+                yield self.source.span(data.entry)
+            else:
+                yield payload
+
+
+class RawTypedTagList(TypedTagList):
+    """`TypedTagList` decoded from an `IndexedTags`.
+
+    Its values are compared with the original bytes when it is written, and
+    the original bytes are copied if they match.
+    """
+    __slots__ = ('source', 'entry', 'offset')
+
+    def __init__(self, type, values, source, entry, offset):
+        TypedTagList.__init__(self, type, values)
+        self.source = source
+        self.entry = entry
+        self.offset = offset
+
+    def untouched(self):
+        end = self.source.span(self.entry)[1]
+        return self.values is not None and \
+            self.source.stream.view[self.offset:end] == self.to_bytes()
+
+    def pieces(self):
+        """Original byte range or encoded list to write, see `encode_tag`."""
+        if self.untouched():
+            return self.source.raw([(self.offset, self.source.span(self.entry)[1])])
+        return iter([self.to_bytes()])
+
+
+def open_meta(filename, index=None):
+    """Meta of `filename` for copy-through rewriting.
+
+    The tag tree comes from `TagIndex.open`, so writing the meta with
+    `Meta.to_file` copies all unchanged parts of the tree from the original
+    file and re-encodes only what was modified. The docked entries are
+    always re-encoded. Compressed tag roots are compressed again, so only
+    their inflated data stays byte-identical.
+
+    Parameters
+    ----------
+    filename: path to a meta.smbpm file
+    index: `TagIndex` of the file, built by decoding it once if None
+    """
+    if index is None:
+        index = TagIndex()
+        Meta.from_file(filename, buffered=True, index=index)
+    with open(filename, 'rb') as file:
+        stream = BinBufferParser.from_file(file)
+    version = stream.get_one('>i')
+    docked = None
+    tags = None
+    while True:
+        tag = TagTypes(stream.get_one('>b'))
+        if tag == TagTypes.finish:
+            break
+        elif tag == TagTypes.segment_manager:
+            tags = TagRoot(index.version, index.open(filename))
+            break
+        elif tag == TagTypes.docking:
+            docked = [MetaDockedEntry.from_file(stream)
+                      for _ in range(stream.get_one('>I'))]
+    return Meta(version, docked, tags)
@@ -0,0 +1,241 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+from devtools.blueprint_files import InflatingParser, MetaDockedEntry, String, Tag
+from devtools.blueprint_files import TagList, TagRoot, TagTypes, TypedTagList, decode_payload
+from devtools.blueprint_files import length_format, open_parser
+
+
+# Encoded size of the payload types that have one
+fixed_sizes = {0: 0, 1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8, 9: 12, 10: 12, 11: 3,
+               14: 1, 15: 16}
+
+
+def skip_payload(stream, type, count=1):
+    """Advance `stream` past `count` payloads of `type` without building them.
+
+    Lists of fixed size payloads are skipped in one step. Payloads of
+    registered types of unknown size are decoded and dropped.
+    """
+    get_one = stream.get_one
+    skip = stream.skip
+    type_format = Tag.type_format
+    # Pending work as [type, count]; count None means the remaining tags of
+    # a struct
+    pending = [[type, count]]
+    while pending:
+        frame = pending[-1]
+        type, count = frame
+        if count is None:
+            tag_type = get_one(type_format)
+            if tag_type == 0:
+                pending.pop()
+                continue
+            if tag_type > 0:
+                skip(get_one(length_format))
+            pending.append([abs(tag_type), 1])
+        elif count == 0:
+            pending.pop()
+        elif type in fixed_sizes:
+            skip(fixed_sizes[type] * count)
+            pending.pop()
+        elif type == 13:
+            frame[1] = count - 1
+            pending.append([13, None])
+        elif type == 12:
+            frame[1] = count - 1
+            pending.append(list(stream.get(TagList.header_format)))
+        elif type == 7 or type == 8:
+            for _ in range(count):
+                skip(get_one(length_format))
+            pending.pop()
+        else:
+            codecs = stream.codecs
+            if not 0 <= type < len(codecs) or codecs[type] is None:
+                raise ValueError('unknown tag-payload type: {}'.format(type))
+            for _ in range(count):
+                codecs[type].decode(stream)
+            pending.pop()
+
+
+def parse_path(path):
+    """Tuple of steps of a path given as a sequence or as a '/' separated
+    string, where all-digit parts are indices."""
+    if isinstance(path, str):
+        return tuple(int(step) if step.isdigit() else step
+                     for step in path.split('/') if step)
+    return tuple(path)
+
+
+def lookup(payload, steps):
+    """Follow `steps` through a decoded payload; None if there is no match."""
+    for step in steps:
+        if payload is None:
+            return None
+        if payload.type == 13:
+            tags = payload.data.tags
+            if isinstance(step, int):
+                payload = tags[step].payload if step < len(tags) else None
+            else:
+                payload = next((tag.payload for tag in tags if tag.name == step), None)
+        elif payload.type == 12 and isinstance(step, int) and \
+                isinstance(payload.data, TypedTagList):
+            data = payload.data
+            payload = data.item(step) if step < data.length() else None
+        elif payload.type == 12 and isinstance(step, int):
+            items = payload.data.list
+            payload = items[step] if step < len(items) else None
+        else:
+            return None
+    return payload
+
+
+class TagQuery(object):
+    """Decode only selected payloads of a tag tree.
+
+    Paths lead from the payload of the root tag through struct members, by
+    name or by position, and list elements, by position. The paths are
+    compiled into a tree of steps. Decoding follows only the branches of that
+    tree, skips everything else without building objects and stops as soon
+    as every path is resolved.
+
+    Parameters
+    ----------
+    paths: iterable of paths, each a string like 'inventory/3/count' or a
+           tuple of steps. A name step matches the first struct member of
+           that name. Results are keyed by the paths as given, with
+           sequences turned into tuples.
+
+    Example
+    -------
+    >>> TagQuery(['sc/power']).from_file('meta.smbpm')
+    {'sc/power': Payload}
+    """
+    def __init__(self, paths):
+        self.paths = list(dict.fromkeys(path if isinstance(path, str) else tuple(path)
+                                        for path in paths))
+        # Each node is a dict of step -> node. The key None holds the paths
+        # that end at the node.
+        self.tree = {}
+        for path in self.paths:
+            node = self.tree
+            for step in parse_path(path):
+                node = node.setdefault(step, {})
+            node.setdefault(None, []).append(path)
+
+    def from_tag(self, stream):
+        """Resolve the paths in the tag tree at the position of `stream`.
+
+        Returns a dict of path -> `Payload` of the paths that exist. The
+        stream is left wherever decoding stopped.
+        """
+        type = stream.get_one(Tag.type_format)
+        if type > 0:
+            stream.skip(stream.get_one(length_format))
+        results = {}
+        self._select(stream, abs(type), self.tree, results, [len(self.paths)])
+        return results
+
+    def from_meta(self, stream):
+        """Like `from_tag`, for a stream at the start of a meta.smbpm."""
+        stream.get_one('>i')
+        while True:
+            tag = TagTypes(stream.get_one('>b'))
+            if tag == TagTypes.finish:
+                return {}
+            elif tag == TagTypes.segment_manager:
+                break
+            elif tag == TagTypes.docking:
+                for _ in range(stream.get_one('>I')):
+                    stream.skip(stream.get_one(length_format))
+                    stream.skip(MetaDockedEntry.static_format.size)
+        if stream.get_one(length_format) == TagRoot.compressed_version:
+            stream = InflatingParser(stream)
+        return self.from_tag(stream)
+
+    def from_file(self, filename, buffered=False):
+        """Like `from_meta`, for a meta.smbpm file."""
+        with open(filename, 'rb') as file:
+            return self.from_meta(open_parser(file, buffered))
+
+    def _select(self, stream, type, node, results, unresolved):
+        """Decode the parts of a payload of `type` selected by `node`.
+
+        Returns True once all paths are resolved.
+        """
+        if None in node:
+            # A path ends here, decode the whole payload and resolve any
+            # longer paths through it from the objects
+            payload = decode_payload(stream, type)
+            self._resolve(payload, node, (), results, unresolved)
+            return unresolved[0] == 0
+        if type == 13:
+            index = 0
+            while True:
+                if not node:
+                    # nothing else can match in this struct
+                    skip_payload(stream, 13)
+                    return False
+                tag_type = stream.get_one(Tag.type_format)
+                if tag_type == 0:
+                    return False
+                name = String.deserialize(stream) if tag_type > 0 else None
+                tag_type = abs(tag_type)
+                selected = [node[key] for key in (name, index) if key in node]
+                if name in node or index in node:
+                    # a name matches only the first member of that name
+                    node = {key: child for key, child in node.items()
+                            if key != name and (not isinstance(key, int) or key > index)}
+                index += 1
+                if not selected:
+                    skip_payload(stream, tag_type)
+                    continue
+                if len(selected) == 1:
+                    done = self._select(stream, tag_type, selected[0], results, unresolved)
+                else:
+                    payload = decode_payload(stream, tag_type)
+                    for child in selected:
+                        self._resolve(payload, child, (), results, unresolved)
+                    done = unresolved[0] == 0
+                if done:
+                    return True
+        elif type == 12:
+            element_type, length = stream.get(TagList.header_format)
+            position = 0
+            for index in sorted(key for key in node if isinstance(key, int)):
+                if index >= length:
+                    break
+                skip_payload(stream, element_type, index - position)
+                if self._select(stream, element_type, node[index], results, unresolved):
+                    return True
+                position = index + 1
+            skip_payload(stream, element_type, length - position)
+        else:
+            skip_payload(stream, type)
+        return False
+
+    def _resolve(self, payload, node, steps, results, unresolved):
+        for step, child in node.items():
+            if step is None:
+                for path in child:
+                    match = lookup(payload, steps)
+                    if match is not None and path not in results:
+                        results[path] = match
+                        unresolved[0] -= 1
+            else:
+                self._resolve(payload, child, steps + (step,), results, unresolved)
@@ -21,6 +21,7 @@
 """
 
 import os
+import shutil
 
 from nose.tools import assert_equal, assert_tuple_equal, assert_raises
 
@@ -35,3 +36,64 @@ def test_blockconfig():
     assert_tuple_equal(bc.blocks[6], ('Cannon Computer', 'Blocks.Ship.Weapons'))
     assert_tuple_equal(bc.blocks[16], ('Cannon Barrel', 'Blocks.Ship.Weapons'))
 
+
+def test_blockconfig_attributes():
+    bc = BlockConfig("tests/BlockTypes.properties", "tests/BlockConfig.xml")
+    barrel = bc.attributes[16]
+    assert_equal(barrel['type'], 'WEAPON_ID')
+    assert_equal(barrel['Price'], '1000')
+    assert_equal(barrel['Hitpoints'], '100')
+    assert_equal(barrel['ControlledBy'].children, (('Element', 'WEAPON_CONTROLLER_ID'),))
+    item = barrel['Consistence'].children[0][1]
+    assert_equal((item.attrib, item.text), ({'count': '50'}, 'TERRAIN_M1L2_ID'))
+    assert_equal(barrel['CubatomCompound'].children[1][1].children[0], ('mass', 'light'))
+
+
+def test_blockconfig_indexes():
+    bc = BlockConfig("tests/BlockTypes.properties", "tests/BlockConfig.xml")
+    assert_equal(bc.ids_by_name['Cannon Computer'], 6)
+    assert_tuple_equal(bc.by_name('Ship Core'), ('Ship Core', 'Blocks.Ship'))
+    assert_raises(KeyError, bc.by_name, 'Nothing')
+    assert_equal(bc.in_category('Blocks.Ship.Weapons'), [6, 16])
+    assert_equal(bc.in_category('Blocks.Ship'), [1, 6, 16])
+    assert_equal(bc.in_category('Blocks.Shi'), [])
+
+
+def test_blockconfig_cache():
+    shutil.copy("tests/BlockTypes.properties", "test_BlockTypes.properties")
+    parse = BlockConfig.parse
+    calls = []
+    BlockConfig.parse = staticmethod(lambda *args: calls.append(args) or parse(*args))
+    try:
+        def load():
+            return BlockConfig("test_BlockTypes.properties", "tests/BlockConfig.xml",
+                               cachedir="test_cache")
+        bc = load()
+        assert_equal(len(calls), 1)
+        assert_equal(len(os.listdir("test_cache")), 1)
+
+        cached = load()
+        assert_equal(len(calls), 1)
+        assert_equal(cached.blocks, bc.blocks)
+
+        with open("test_BlockTypes.properties", "a") as file:
+            file.write("\nUNUSED_ID=999\n")
+        stat = os.stat("test_BlockTypes.properties")
+        os.utime("test_BlockTypes.properties", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        load()
+        assert_equal(len(calls), 2)
+    finally:
+        BlockConfig.parse = parse
+        os.remove("test_BlockTypes.properties")
+        shutil.rmtree("test_cache")
+
+
+def test_blockconfig_cache_unwritable():
+    # a file where the cache directory should be
+    open("test_cache", "w").close()
+    try:
+        bc = BlockConfig("tests/BlockTypes.properties", "tests/BlockConfig.xml",
+                         cachedir=os.path.join("test_cache", "pysmade"))
+        assert_tuple_equal(bc.blocks[1], ('Ship Core', 'Blocks.Ship'))
+    finally:
+        os.remove("test_cache")
@@ -20,14 +20,29 @@
     <https://starmadepedia.net/wiki/Blueprint_File_Formats> (June 4, 2015).
 """
 
+import asyncio
+import copy
+import io
 import os
+import pickle
+import shutil
 import struct
+import sys
+import threading
+import time
+import zlib
 
-from nose.tools import assert_equal, assert_tuple_equal
+from nose.tools import assert_equal, assert_tuple_equal, assert_raises, assert_true
 
-from devtools.blueprint_files import BinFileParser, EntityTypes, Header
+from devtools.blueprint_files import BinFileParser, BinBufferParser
+from devtools.blueprint_files import EntityTypes, Header
 from devtools.blueprint_files import Meta, MetaDockedEntry, TagRoot, Tag
-from devtools.blueprint_files import Payload, TagStruct, TagList
+from devtools.blueprint_files import Payload, PayloadCodec, TagStruct, TagList
+from devtools.blueprint_files import TagLimitError, TypedTagList, decode_tag, encode_tag
+from devtools.blueprint_files import Logic, Segment, SegmentFile, load_segments
+from devtools.blueprint_files import aload_blueprint, load_blueprint, write_atomic
+from devtools.blueprint_files import imap_threaded
+from devtools.synthetic import synthetic_header, synthetic_meta
 
 
 def assert_headers_equal(a, b):
@@ -97,6 +112,16 @@ def test_binfileparser():
         assert_tuple_equal(parser.get('bbb'), (0, 1, 2))
 
 
+def test_binbufferparser():
+    parser = BinBufferParser(b'\00\01\02\00\03abc')
+    assert_tuple_equal(parser.get('bbb'), (0, 1, 2))
+    assert_equal(parser.get_one(struct.Struct('>H')), 3)
+    view = parser.get_bytes(3)
+    assert_equal(type(view), memoryview)
+    assert_equal(view, b'abc')
+    assert_raises(struct.error, parser.get_one, 'b')
+
+
 def test_header_repr():
     original = Header(1, EntityTypes.asteroid, -1, -2, -3, 4, 5, 6, {7: 800, 13: 900, 3: 42})
     copied = eval(repr(original))
@@ -111,6 +136,14 @@ def test_header_read_write_consistency():
     assert_headers_equal(original, copied)
 
 
+def test_header_buffered_read():
+    original = Header(1, EntityTypes.ship, -1, -2, -3, 4, 5, 6, {7: 800, 13: 900, 3: 42})
+    original.to_file('test.smbph')
+    copied = Header.from_file('test.smbph', buffered=True)
+    os.remove('test.smbph')
+    assert_headers_equal(original, copied)
+
+
 def test_meta():
     docked = [MetaDockedEntry("name", [1, 2, 3], [1.0, 2.0, 3.0], 7, -1)]
 
@@ -129,4 +162,401 @@ def test_meta():
 
     reload = Meta.from_file('test.smbpm')
 
-    assert_meta_equal(meta, reload)
\ No newline at end of file
+    assert_meta_equal(meta, reload)
+
+
+def test_meta_buffered_read():
+    docked = [MetaDockedEntry("name", [1, 2, 3], [1.0, 2.0, 3.0], 7, -1)]
+    bytearray_tag = Tag("bytes", Payload(7, b'123'))
+    struct_tag = Tag(None, Payload(13, TagStruct([bytearray_tag])))
+    meta = Meta(version=0, docked=docked, tags=TagRoot(version=0, tag=struct_tag))
+    meta.to_file('test.smbpm')
+
+    reload = Meta.from_file('test.smbpm', buffered=True)
+    os.remove('test.smbpm')
+
+    assert_meta_equal(meta, reload)
+    data = reload.tags.tag.payload.data.tags[0].payload.data
+    assert_equal(type(data), bytes)
+    assert_equal(data, b'123')
+    assert_equal(repr(reload.tags.tag), repr(struct_tag))
+
+
+def test_payload_codecs():
+    for type in range(1, 16):
+        assert Payload.codecs[type] is not None
+    assert_raises(ValueError, Payload.deserialize, BinBufferParser(b'\00'), 16)
+    assert_raises(ValueError, Payload.deserialize, BinBufferParser(b'\00'), -1)
+    assert_raises(ValueError, Payload.register_codec, 0, None, None)
+
+
+def test_payload_register_codec():
+    decoder = struct.Struct('>hh')
+    Payload.register_codec(100, lambda stream: stream.get(decoder),
+                           lambda file, data: file.write(decoder.pack(*data)))
+    try:
+        tag = Tag("pair", Payload(100, (-3, 4)))
+        root = TagRoot(version=0, tag=Tag(None, Payload(13, TagStruct([tag]))))
+        Meta(version=0, docked=[], tags=root).to_file('test.smbpm')
+        reload = Meta.from_file('test.smbpm')
+        os.remove('test.smbpm')
+        assert_equal(reload.tags.tag.payload.data.tags[0].payload.data, (-3, 4))
+    finally:
+        del Payload.codecs[16:]
+
+
+def test_meta_compressed():
+    big = bytes(bytearray(range(256))) * 200
+    tags = [Tag("big", Payload(7, big)), Tag("name", Payload(8, "compressed")),
+            Tag(None, Payload(12, TagList(3, [Payload(3, i) for i in range(1000)])))]
+    root = TagRoot(version=TagRoot.compressed_version,
+                   tag=Tag(None, Payload(13, TagStruct(tags))))
+    meta = Meta(version=0, docked=[], tags=root)
+    for level in [0, 1, 9]:
+        meta.to_file('test.smbpm', compresslevel=level)
+        for buffered in [False, True]:
+            reload = Meta.from_file('test.smbpm', buffered=buffered)
+            assert_meta_equal(meta, reload)
+    assert len(big) > os.path.getsize('test.smbpm')
+    os.remove('test.smbpm')
+
+
+def test_tagroot_compressed_stream_position():
+    tag = Tag("x", Payload(3, 42))
+    raw = io.BytesIO()
+    tag.to_file(raw)
+    # zlib-wrapped data is accepted as well as gzip, trailing bytes are kept
+    data = struct.pack('>H', 1) + zlib.compress(raw.getvalue()) + b'\x07'
+    for stream in [BinBufferParser(data), BinFileParser(io.BytesIO(data))]:
+        root = TagRoot.deserialize(stream)
+        assert_tags_equal(root.tag, tag)
+        assert_equal(stream.get_one('b'), 7)
+
+
+def test_iterative_tags():
+    tags = [Tag("name", Payload(8, "deep")),
+            Tag(None, Payload(12, TagList(13, [Payload(13, TagStruct([]))] * 3))),
+            Tag(None, Payload(12, TagList(9, [Payload(9, (1.0, 2.0, 3.0))] * 4)))]
+    tag = Tag(None, Payload(13, TagStruct(tags)))
+    for _ in range(5000):
+        tag = Tag("level", Payload(13, TagStruct([tag, Tag("x", Payload(3, 1))])))
+    data = io.BytesIO()
+    encode_tag(data, tag)
+    data = data.getvalue()
+
+    reload = decode_tag(BinBufferParser(data))
+    out = io.BytesIO()
+    encode_tag(out, reload)
+    assert_equal(out.getvalue(), data)
+    for _ in range(5000):
+        reload = reload.payload.data.tags[0]
+    assert_tags_equal(reload, Tag(None, Payload(13, TagStruct(tags))))
+
+    # 5000 levels, the innermost struct, a list and the structs in it
+    decode_tag(BinBufferParser(data), 5003, len(data))
+    assert_raises(TagLimitError, decode_tag, BinBufferParser(data), 5002)
+    assert_raises(TagLimitError, decode_tag, BinBufferParser(data), None, len(data) - 1)
+
+    # an empty list claiming four billion elements is rejected up front
+    bogus = struct.pack('>bHsbI', 12, 1, b'l', 0, 2 ** 32 - 1)
+    assert_raises(TagLimitError, decode_tag, BinBufferParser(bogus), None, 1000)
+
+    meta = Meta(0, [], TagRoot(TagRoot.compressed_version, tag))
+    assert_raises(TagLimitError, Meta.from_buffer, meta.to_bytes(), max_bytes=1000)
+    assert_equal(Meta.from_buffer(meta.to_bytes()).to_bytes(), meta.to_bytes())
+
+
+def test_to_bytes():
+    header = Header(1, EntityTypes.station, -1, -2, -3, 4, 5, 6, {7: 800, 3: 42})
+    header.to_file('test.smbph')
+    with open('test.smbph', 'rb') as file:
+        assert_equal(file.read(), header.to_bytes())
+    os.remove('test.smbph')
+    assert_headers_equal(header, Header.from_buffer(header.to_bytes()))
+
+    docked = [MetaDockedEntry("name", [1, 2, 3], [1.0, 2.0, 3.0], 7, -1)]
+    root = TagRoot(version=0, tag=Tag("s", Payload(8, "string")))
+    meta = Meta(version=0, docked=docked, tags=root)
+    meta.to_file('test.smbpm')
+    with open('test.smbpm', 'rb') as file:
+        assert_equal(file.read(), meta.to_bytes())
+    os.remove('test.smbpm')
+    assert_meta_equal(meta, Meta.from_buffer(meta.to_bytes()))
+    assert not [f for f in os.listdir('.') if f.startswith('.test.smbp')]
+
+
+def test_segment_blocks():
+    segment = Segment((32, 0, -64))
+    segment.set_block(1, 2, 3, 16, hitpoints=100, active=True, orientation=5)
+    segment.set_block(31, 31, 31, 2047)
+    assert_tuple_equal(segment.block(1, 2, 3), (16, 100, True, 5))
+    assert_tuple_equal(segment.block(0, 0, 0), (0, 0, False, 0))
+    ids = segment.ids()
+    assert_equal(ids[Segment.index(1, 2, 3)], 16)
+    assert_equal(ids[Segment.index(31, 31, 31)], 2047)
+    assert_equal(sum(ids), 16 + 2047)
+
+
+def test_segmentfile():
+    first = Segment((0, 0, 0), timestamp=123)
+    first.set_block(0, 0, 0, 1)
+    second = Segment((32, 64, 0))
+    second.set_block(4, 5, 6, 16, hitpoints=42, orientation=3)
+    SegmentFile.to_file('test.smd2', {SegmentFile.local_index(1, 2, 0): second,
+                                      SegmentFile.local_index(0, 0, 0): first})
+    with SegmentFile('test.smd2') as region:
+        assert_equal(len(region), 2)
+        assert SegmentFile.local_index(0, 0, 0) in region
+        assert SegmentFile.local_index(1, 0, 0) not in region
+        assert_raises(KeyError, region.raw, SegmentFile.local_index(1, 0, 0))
+        segments = list(region)
+        assert_equal([s.position for s in segments], [(0, 0, 0), (32, 64, 0)])
+        assert_equal(segments[0].timestamp, 123)
+        assert_equal(segments[0].blocks, first.blocks)
+        assert_equal(segments[1].blocks, second.blocks)
+        assert_tuple_equal(region[SegmentFile.local_index(1, 2, 0)].block(4, 5, 6),
+                           (16, 42, False, 3))
+        del segments
+    os.remove('test.smd2')
+
+    open('test.smd2', 'wb').close()
+    with SegmentFile('test.smd2') as region:
+        assert_equal(len(region), 0)
+        assert_equal(list(region), [])
+    os.remove('test.smd2')
+
+
+def test_load_segments():
+    os.makedirs('test_blueprint/DATA')
+    for region in range(2):
+        segments = {}
+        for i in range(20):
+            segment = Segment((32 * i, 0, 512 * region))
+            segment.set_block(0, 0, 0, i + 1)
+            segments[i] = segment
+        SegmentFile.to_file('test_blueprint/DATA/test.0.0.{}.smd2'.format(region),
+                            segments)
+    open('test_blueprint/DATA/test.0.0.2.smd2', 'wb').close()
+    try:
+        expected = [(32 * i, 0, 512 * region) for region in range(2) for i in range(20)]
+        for workers in [1, 4]:
+            loaded = list(load_segments('test_blueprint', workers=workers))
+            assert_equal([s.position for s in loaded], expected)
+            loaded = load_segments('test_blueprint', workers=workers, ordered=False)
+            assert_equal(sorted(s.position for s in loaded), sorted(expected))
+
+        selected = load_segments('test_blueprint', workers=2,
+                                 select=lambda filename, i: i % 2 == 0)
+        assert_equal([s.block(0, 0, 0).id for s in selected], list(range(1, 21, 2)) * 2)
+
+        with SegmentFile('test_blueprint/DATA/test.0.0.1.smd2') as region:
+            loaded = list(region.load([3, 1], workers=2))
+            assert_equal([s.position for s in loaded], [(96, 0, 512), (32, 0, 512)])
+            del loaded
+
+        # stopping early waits for the workers before unmapping the regions
+        for ordered in [True, False]:
+            loaded = load_segments('test_blueprint', workers=4, ordered=ordered)
+            next(loaded)
+            loaded.close()
+    finally:
+        shutil.rmtree('test_blueprint')
+
+
+def test_imap_threaded_close():
+    lock = threading.Lock()
+    calls = {'started': 0, 'running': 0}
+
+    def work(item):
+        with lock:
+            calls['started'] += 1
+            calls['running'] += 1
+        time.sleep(0.01)
+        with lock:
+            calls['running'] -= 1
+        return item
+
+    for ordered in [True, False]:
+        calls['started'] = 0
+        results = imap_threaded(work, range(100), 2, ordered)
+        next(results)
+        results.close()
+        assert_equal(calls['running'], 0)
+        assert_true(calls['started'] < 5)
+
+
+def test_aload_blueprint():
+    paths = [os.path.join('test_blueprints', 'bp{}'.format(i)) for i in range(300)]
+    for i, path in enumerate(paths):
+        os.makedirs(path)
+        synthetic_header(10 + i % 50, seed=i).to_file(os.path.join(path, 'header.smbph'))
+        synthetic_meta(depth=2, breadth=4, n_docked=i % 3, list_length=3,
+                       compressed=i % 2 == 1, seed=i).to_file(os.path.join(path, 'meta.smbpm'))
+    try:
+        async def load_all(buffered):
+            return await asyncio.gather(*[aload_blueprint(path, buffered) for path in paths])
+
+        for buffered in [False, True]:
+            loaded = asyncio.run(load_all(buffered))
+            for path, blueprint in zip(paths, loaded):
+                expected = load_blueprint(path)
+                assert_equal(blueprint.path, path)
+                assert_headers_equal(blueprint.header, expected.header)
+                assert_equal(blueprint.meta.to_bytes(), expected.meta.to_bytes())
+
+        header = asyncio.run(Header.aload(os.path.join(paths[0], 'header.smbph'),
+                                          histogram=True))
+        assert_equal(dict(header.elements), load_blueprint(paths[0]).header.elements)
+    finally:
+        shutil.rmtree('test_blueprints')
+
+
+def test_compact_tags():
+    tags = [Tag('name', Payload(13, TagStruct([Tag('x' + str(i), Payload(3, i))])))
+            for i in range(3)]
+    data = io.BytesIO()
+    encode_tag(data, Tag(None, Payload(13, TagStruct(tags))))
+    for decode in [decode_tag, Tag.deserialize]:
+        tag = decode(BinBufferParser(data.getvalue()))
+        first, second = tag.payload.data.tags[:2]
+        assert_equal(first.name, 'name')
+        assert_true(first.name is second.name)
+        assert_true(first.payload.data.tags[0].name is sys.intern('x0'))
+        for obj in [tag, tag.payload, tag.payload.data, first.payload.data.tags[0].payload]:
+            assert_raises(AttributeError, setattr, obj, 'extra', 1)
+
+    # the shared end tag is read-only
+    end = Tag.deserialize(BinBufferParser(b'\x00'))
+    assert_true(end.payload is Payload.deserialize(BinBufferParser(b''), 0))
+    assert_raises(AttributeError, setattr, end, 'name', 'x')
+    assert_raises(AttributeError, setattr, end.payload, 'data', 1)
+    assert_raises(AttributeError, delattr, end.payload, 'type')
+    assert_equal((end.name, end.payload.type, end.payload.data), (None, 0, None))
+
+    # and stays the shared one when copied or pickled
+    for clone in [copy.copy, copy.deepcopy, lambda o: pickle.loads(pickle.dumps(o))]:
+        assert_true(clone(end) is end)
+        assert_true(clone(end.payload) is end.payload)
+    meta = pickle.loads(pickle.dumps(Meta(0, [], TagRoot())))
+    assert_true(meta.tags.tag is end)
+    meta = copy.deepcopy(Meta(0, [], TagRoot()))
+    assert_true(meta.tags.tag is end)
+
+
+def test_typed_taglist():
+    for type, data in [(1, -5), (2, 300), (3, -70000), (4, 2 ** 40), (5, 0.5), (6, 0.1),
+                       (9, (1.0, 2.0, 3.5)), (10, (1, -2, 3)), (11, (1, 2, -3)), (14, 1),
+                       (15, (1.0, 2.0, 3.0, 4.0))]:
+        tl = TagList(type, [Payload(type, data)] * 100)
+        tag = Tag('list', Payload(12, tl))
+        file = io.BytesIO()
+        encode_tag(file, tag)
+        encoded = file.getvalue()
+
+        for decode in [decode_tag, Tag.deserialize]:
+            typed = decode(BinBufferParser(encoded)).payload.data
+            assert_equal(typed.__class__, TypedTagList)
+            assert_equal(typed.length(), 100)
+            assert_equal(typed.elements(), [data] * 100)
+            assert_equal(repr(typed), repr(tl))
+            file = io.BytesIO()
+            encode_tag(file, Tag('list', Payload(12, typed)))
+            assert_equal(file.getvalue(), encoded)
+
+            # a stream with its own codecs decodes element by element
+            stream = BinBufferParser(encoded)
+            stream.codecs = [PayloadCodec(*codec) for codec in stream.codecs]
+            assert_equal(decode(stream).payload.data.__class__, TagList)
+
+            # reading single elements keeps the array
+            assert_equal(typed.item(-1).data, data)
+            assert_raises(IndexError, typed.item, 100)
+            assert_true(typed.values is not None)
+
+            # reading the list turns it into Payloads, which are written back
+            assert_true(isinstance(typed.list, list))
+            assert_equal(typed.values, None)
+            assert_equal([payload.data for payload in typed.list], [data] * 100)
+            assert_true(typed.list[0] is typed.list[0])
+            typed.list[0].data = typed.list[1].data
+            assert_equal(typed.to_bytes(), encoded[7:])
+
+    # elements changed in place survive a round trip
+    file = io.BytesIO()
+    encode_tag(file, Tag('list', Payload(12, TagList(3, [Payload(3, 1)] * 100))))
+    typed = decode_tag(BinBufferParser(file.getvalue())).payload.data
+    typed.list[0].data = 99
+    for payload in typed.list[1:]:
+        payload.data += 10
+    file = io.BytesIO()
+    encode_tag(file, Tag('list', Payload(12, typed)))
+    assert_equal(decode_tag(BinBufferParser(file.getvalue())).payload.data.elements(),
+                 [99] + [11] * 99)
+
+    encoded = encoded[:-4]
+    assert_raises(struct.error, decode_tag, BinBufferParser(encoded))
+    assert_raises(TagLimitError, decode_tag, BinBufferParser(encoded), max_bytes=1000)
+
+
+def test_logic():
+    links = {(16, 16, 16): {405: [(17, 16, 16), (18, 16, 16)], 8: [(-3, 0, 40)]},
+             (0, -1, 2): {},
+             (20, 16, 16): {405: [(18, 16, 16)]}}
+    encoded = (struct.pack('>ii', 0, 3) +
+               struct.pack('>hhhi', 16, 16, 16, 2) +
+               struct.pack('>Hi', 405, 2) + struct.pack('>6h', 17, 16, 16, 18, 16, 16) +
+               struct.pack('>Hi', 8, 1) + struct.pack('>3h', -3, 0, 40) +
+               struct.pack('>hhhi', 0, -1, 2, 0) +
+               struct.pack('>hhhi', 20, 16, 16, 1) +
+               struct.pack('>Hi', 405, 1) + struct.pack('>3h', 18, 16, 16))
+    logic = Logic.from_dict(links)
+    assert_equal(logic.to_bytes(), encoded)
+
+    with open('test.smbpl', 'wb') as file:
+        file.write(encoded)
+    try:
+        for buffered in [False, True]:
+            logic = Logic.from_file('test.smbpl', buffered)
+            assert_equal(len(logic), 3)
+            assert_equal(logic.to_dict(), links)
+            assert_equal(logic.to_bytes(), encoded)
+    finally:
+        os.remove('test.smbpl')
+
+    logic = Logic.from_buffer(encoded)
+    assert_equal(logic.group((16, 16, 16)), links[(16, 16, 16)])
+    assert_equal(logic.group((0, -1, 2)), {})
+    assert_equal(logic.group((1, 1, 1)), {})
+    assert_equal(sorted(logic.controlled_by((18, 16, 16))),
+                 [((16, 16, 16), 405), ((20, 16, 16), 405)])
+    assert_equal(logic.controlled_by((-3, 0, 40)), [((16, 16, 16), 8)])
+    assert_equal(logic.controlled_by((16, 16, 16)), [])
+
+    assert_raises(struct.error, Logic.from_buffer, encoded[:-2])
+
+
+def test_empty_taglist():
+    for tl in [TagList(3, []), TagList(13, [])]:
+        file = io.BytesIO()
+        encode_tag(file, Tag('list', Payload(12, tl)))
+        data = decode_tag(BinBufferParser(file.getvalue())).payload.data
+        # an empty list is still a present payload
+        assert_true(data)
+        assert_equal(len(data.list), 0)
+        assert_equal(data.type, tl.type)
+
+
+def test_write_atomic():
+    umask = os.umask(0o027)
+    try:
+        write_atomic('test.atomic', b'new')
+        assert_equal(os.stat('test.atomic').st_mode & 0o777, 0o640)
+        os.chmod('test.atomic', 0o604)
+        write_atomic('test.atomic', b'replaced')
+        assert_equal(os.stat('test.atomic').st_mode & 0o777, 0o604)
+        with open('test.atomic', 'rb') as file:
+            assert_equal(file.read(), b'replaced')
+        assert_equal([name for name in os.listdir('.') if name.startswith('.test.atomic')], [])
+    finally:
+        os.umask(umask)
+        os.remove('test.atomic')
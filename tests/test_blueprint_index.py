@@ -0,0 +1,124 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import shutil
+
+from nose.tools import assert_equal, assert_true
+
+from devtools.blueprint_files import EntityTypes, Header, Meta, MetaDockedEntry, TagRoot
+from devtools.blueprint_index import BlueprintIndex
+
+
+def real(*paths):
+    return [os.path.realpath(path) for path in paths]
+
+
+def make_blueprint(path, type, size, elements, docked=0):
+    os.makedirs(path)
+    Header(0, type, 0, 0, 0, size, size / 2, size / 4, elements).to_file(
+        os.path.join(path, 'header.smbph'))
+    docked = [MetaDockedEntry('turret', (0, 0, 0), (1, 1, 1), 0, 0)] * docked
+    Meta(0, docked, TagRoot()).to_file(os.path.join(path, 'meta.smbpm'))
+
+
+def test_blueprint_index():
+    make_blueprint('test_index/small', EntityTypes.ship, 50, {16: 600, 1: 1})
+    make_blueprint('test_index/large', EntityTypes.ship, 150, {16: 900, 1: 1}, docked=3)
+    make_blueprint('test_index/station', EntityTypes.station, 80, {16: 100, 5: 1000})
+    os.makedirs('test_index/broken')
+    open('test_index/broken/header.smbph', 'wb').close()
+    make_blueprint('test_index/no_meta', EntityTypes.ship, 10, {16: 700})
+    with open('test_index/no_meta/meta.smbpm', 'wb') as file:
+        file.write(b'\x00')
+    try:
+        with BlueprintIndex('test_index.sqlite') as index:
+            index.build('test_index', processes=1)
+            assert_equal(len(index), 5)
+            assert_equal([e[0] for e in index.errors()], real('test_index/broken'))
+            assert_equal([e[0] for e in index.meta_errors()], real('test_index/no_meta'))
+            assert_equal(index.query(min_elements={16: 650}),
+                         real('test_index/large', 'test_index/no_meta'))
+            index.remove('test_index/no_meta')
+
+            record = index.get('test_index/large')
+            assert_equal(record['type'], 'ship')
+            assert_equal(record['docked'], 3)
+            assert_equal(record['elements'], {1: 1, 16: 900})
+            assert_equal(record['xmax'], 150)
+            assert_equal(index.get('nothing'), None)
+
+            assert_equal(index.query(min_elements={16: 500}),
+                         real('test_index/large', 'test_index/small'))
+            assert_equal(index.query(min_elements={16: 500}, max_size=100),
+                         real('test_index/small'))
+            assert_equal(index.query(type='station'), real('test_index/station'))
+            assert_equal(index.query(max_elements={5: 10}),
+                         real('test_index/large', 'test_index/small'))
+            assert_equal(index.query(min_docked=1), real('test_index/large'))
+
+            index.remove('test_index/large')
+            assert_equal(index.query(min_elements={16: 500}), real('test_index/small'))
+
+        with BlueprintIndex('test_index.sqlite') as index:
+            assert_equal(len(index), 3)
+    finally:
+        shutil.rmtree('test_index')
+        os.remove('test_index.sqlite')
+
+
+def test_blueprint_index_update():
+    make_blueprint('test_index/a', EntityTypes.ship, 10, {1: 1})
+    make_blueprint('test_index/b', EntityTypes.ship, 10, {1: 2})
+    make_blueprint('test_index/c', EntityTypes.ship, 10, {1: 3})
+    try:
+        with BlueprintIndex('test_index.sqlite') as index:
+            delta = index.update('test_index', processes=1)
+            assert_equal(delta, (real('test_index/a', 'test_index/b', 'test_index/c'), [], []))
+            assert_equal(index.update('test_index', processes=1), ([], [], []))
+            # the same root given as an absolute path
+            assert_equal(index.update(os.path.abspath('test_index') + os.sep, processes=1),
+                         ([], [], []))
+
+            # touched but identical content is not a change
+            stat = os.stat('test_index/a/meta.smbpm')
+            os.utime('test_index/a/meta.smbpm', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            assert_equal(index.update('test_index', processes=1), ([], [], []))
+
+            # same size, different content
+            Header(0, EntityTypes.ship, 0, 0, 0, 10, 5, 2.5, {1: 20}).to_file(
+                'test_index/b/header.smbph')
+            shutil.rmtree('test_index/c')
+            make_blueprint('test_index/d', EntityTypes.ship, 10, {1: 4})
+            os.makedirs('test_index/a/DATA')
+            open('test_index/a/DATA/a.0.0.0.smd2', 'wb').close()
+
+            delta = index.update('test_index', processes=1)
+            assert_equal(delta, (real('test_index/d'), real('test_index/a', 'test_index/b'),
+                                 real('test_index/c')))
+            assert_equal(index.get('test_index/b')['elements'], {1: 20})
+            assert_equal(index.query(), real('test_index/a', 'test_index/b', 'test_index/d'))
+            # segment files are not read
+            hashes = dict(index.connection.execute('SELECT name, hash FROM files '
+                                                   'WHERE blueprint = ?', real('test_index/a')))
+            assert_equal(hashes[os.path.join('DATA', 'a.0.0.0.smd2')], None)
+            assert_true(hashes['meta.smbpm'] is not None)
+            assert_equal(index.update('test_index', processes=1), ([], [], []))
+    finally:
+        shutil.rmtree('test_index')
+        os.remove('test_index.sqlite')
@@ -0,0 +1,71 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import shutil
+
+from nose.tools import assert_equal, assert_true
+
+from devtools.blueprint_files import EntityTypes, Header, Meta, TagRoot
+from devtools.catalog import CatalogTotals, find_blueprints, scan_catalog
+
+
+def make_catalog(root):
+    for i in range(5):
+        path = os.path.join(root, 'ships', 'ship{}'.format(i))
+        os.makedirs(os.path.join(path, 'ATTACHED_0'))
+        Header(2, EntityTypes.ship, -1, -1, -1, 1, 1, 1, {1: 1, 16: i}).to_file(
+            os.path.join(path, 'header.smbph'))
+        Header(2, EntityTypes.ship, 0, 0, 0, 0, 0, 0, {1: 1}).to_file(
+            os.path.join(path, 'ATTACHED_0', 'header.smbph'))
+        Meta(0, [], TagRoot()).to_file(os.path.join(path, 'meta.smbpm'))
+    os.makedirs(os.path.join(root, 'broken'))
+    with open(os.path.join(root, 'broken', 'header.smbph'), 'wb') as file:
+        file.write(b'\x00\x01')
+    path = os.path.join(root, 'no_meta')
+    os.makedirs(path)
+    Header(2, EntityTypes.ship, 0, 0, 0, 1, 1, 1, {2: 7}).to_file(
+        os.path.join(path, 'header.smbph'))
+
+
+def test_scan_catalog():
+    make_catalog('test_catalog')
+    try:
+        assert_equal(len(list(find_blueprints('test_catalog'))), 7)
+        for processes in [1, 2]:
+            records = list(scan_catalog('test_catalog', meta=True, processes=processes))
+            assert_equal(len(records), 7)
+            errors = [r for r in records if 'error' in r]
+            assert_equal([r['path'] for r in errors], [os.path.realpath(os.path.join('test_catalog', 'broken'))])
+            ok = sorted((r for r in records if 'error' not in r), key=lambda r: r['path'])
+            # a missing meta file keeps the header data
+            assert_equal(ok[0]['path'], os.path.realpath(os.path.join('test_catalog', 'no_meta')))
+            assert_equal(ok[0]['elements'], {2: 7})
+            assert_true('meta_error' in ok[0])
+            ok = ok[1:]
+            assert_equal(ok[3]['elements'], {1: 1, 16: 3})
+            assert_equal(ok[3]['type'], 'ship')
+            assert_equal(ok[3]['docked'], 0)
+
+            totals = CatalogTotals()
+            for record in records:
+                totals.add(record)
+            assert_equal(totals.to_dict(), {'blueprints': 6, 'errors': 1, 'blocks': 22,
+                                             'elements': {1: 5, 2: 7, 16: 10}})
+    finally:
+        shutil.rmtree('test_catalog')
@@ -0,0 +1,63 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import io
+import os
+
+from nose.tools import assert_equal, assert_true
+
+from devtools.blueprint_files import Meta, MetaDockedEntry
+from devtools.decode_stats import DecodeStats
+from devtools.synthetic import count_tags, synthetic_meta
+
+
+def test_decode_stats():
+    for compressed in [False, True]:
+        meta = synthetic_meta(depth=3, breadth=6, n_docked=4, compressed=compressed)
+        meta.to_file('test.smbpm')
+        calls = []
+        stats = DecodeStats(callback=lambda *args: calls.append(args), stacks=True)
+        try:
+            for buffered in [False, True]:
+                reload = Meta.from_file('test.smbpm', buffered, stats=stats)
+                assert_equal(reload.to_bytes(), meta.to_bytes())
+        finally:
+            os.remove('test.smbpm')
+
+        counts = stats.by_type()
+        # every tag and list element, plus one end marker per struct
+        payloads = sum(c for type, (c, b, s) in counts.items() if type not in [0, 'docking'])
+        assert_equal(payloads, 2 * count_tags(meta.tags.tag))
+        docking = 4 + sum(2 + len(d.name) + MetaDockedEntry.static_format.size
+                          for d in meta.docked)
+        assert_equal(counts['docking'][:2], (2, 2 * docking))
+        assert_equal(len(calls), sum(stats.counts.values()) - 2)
+
+        # the root struct includes everything nested in it
+        root = stats.bytes[13, 0] + stats.bytes['docking', 0]
+        assert_equal(sum(stats.self_bytes.values()), root)
+        if not compressed:
+            # version, section markers, root tag version, type and name length
+            assert_equal(root // 2, len(meta.to_bytes()) - 10)
+
+        folded = io.StringIO()
+        stats.write_folded(folded)
+        lines = folded.getvalue().splitlines()
+        assert_true('meta;docking' in [line.split()[0] for line in lines])
+        assert_true(any(line.startswith('meta;struct;list;') for line in lines))
+        assert_true(stats.report().startswith('type'))
@@ -0,0 +1,104 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import shutil
+
+from nose.tools import assert_equal, assert_true
+
+from devtools.blueprint_files import EntityTypes, Header, Meta, MetaDockedEntry, TagRoot
+from devtools.docking import _read_blueprint, load_docking_tree
+
+
+def make_blueprint(path, elements, box, docked):
+    os.makedirs(path)
+    Header(2, EntityTypes.ship, *(box + (elements,))).to_file(os.path.join(path, 'header.smbph'))
+    entries = [MetaDockedEntry(name, pos, [1.0, 1.0, 1.0], 0, 0) for name, pos in docked]
+    Meta(0, entries, TagRoot()).to_file(os.path.join(path, 'meta.smbpm'))
+
+
+def test_load_docking_tree():
+    root = 'test_carrier'
+    turrets = [('ATTACHED_{}'.format(i), [10 * i, 20, 0]) for i in range(6)]
+    make_blueprint(root, {1: 100}, (-10, -10, -10, 10, 10, 10),
+                   turrets + [('ATTACHED_99', [0, 0, 0])])
+    for name, _ in turrets:
+        path = os.path.join(root, name)
+        make_blueprint(path, {2: 5}, (-1, -1, -1, 1, 1, 1), [('ATTACHED_0', [0, 3, 0])])
+        make_blueprint(os.path.join(path, 'ATTACHED_0'), {3: 1}, (0, 0, 0, 0, 0, 0), [])
+    try:
+        for workers in [1, 4]:
+            cache = {}
+            tree = load_docking_tree(root, workers, cache)
+            assert_equal(len(tree), 13)
+            assert_equal(len(cache), 3)
+            assert_equal([entry.name for entry in tree.missing], ['ATTACHED_99'])
+            assert_equal([child.entry.name for child in tree.children],
+                         [name for name, _ in turrets])
+            assert_true(all(child.header is tree.children[0].header
+                            for child in tree.children))
+            assert_equal(tree.element_counts(), {1: 100, 2: 30, 3: 6})
+            assert_equal(tree.bounding_box(), (-10, -10, -10, 51, 23, 10))
+
+            again = load_docking_tree(root, workers, cache)
+            assert_true(again.meta is tree.meta)
+    finally:
+        shutil.rmtree(root)
+
+
+def test_untrusted_docking_names():
+    root = 'test_docked_names'
+    make_blueprint(root, {1: 1}, (0, 0, 0, 0, 0, 0),
+                   [(name, [0, 0, 0]) for name in
+                    ['..', '.', '', 'ATTACHED_0/ATTACHED_0', '../test_docked_names',
+                     os.path.abspath(root), 'LOOP', 'OUTSIDE', 'ATTACHED_0', 'ATTACHED_0']])
+    make_blueprint(os.path.join(root, 'ATTACHED_0'), {2: 1}, (0, 0, 0, 0, 0, 0),
+                   [('ATTACHED_0', [0, 0, 0])])
+    make_blueprint(os.path.join(root, 'ATTACHED_0', 'ATTACHED_0'), {3: 1}, (0, 0, 0, 0, 0, 0),
+                   [])
+    make_blueprint(root + '_outside', {4: 1}, (0, 0, 0, 0, 0, 0), [])
+    os.symlink(os.path.abspath(root), os.path.join(root, 'LOOP'))
+    os.symlink(os.path.abspath(root + '_outside'), os.path.join(root, 'OUTSIDE'))
+    try:
+        tree = load_docking_tree(root)
+        assert_equal([child.entry.name for child in tree.children], ['ATTACHED_0'])
+        assert_equal(len(tree.rejected), 9)
+        assert_equal(tree.missing, [])
+        assert_equal(tree.element_counts(), {1: 1, 2: 1, 3: 1})
+
+        tree = load_docking_tree(root, max_depth=1)
+        assert_equal(tree.element_counts(), {1: 1, 2: 1})
+        assert_equal(len(tree.children[0].rejected), 1)
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(root + '_outside')
+
+
+def test_blueprint_key():
+    root = 'test_blueprint_key'
+    os.makedirs(root)
+    try:
+        keys = set()
+        for header, meta in [(b'ab', b'c'), (b'a', b'bc')]:
+            for name, data in [('header.smbph', header), ('meta.smbpm', meta)]:
+                with open(os.path.join(root, name), 'wb') as file:
+                    file.write(data)
+            keys.add(_read_blueprint(root)[0])
+        assert_equal(len(keys), 2)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,97 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import shutil
+from collections import Counter
+
+from nose.tools import assert_equal
+
+from devtools.blueprint_files import EntityTypes, Header, Segment, SegmentFile
+from devtools.header_check import rebuild_header, segment_extent, verify_header
+
+
+def test_segment_extent():
+    segment = Segment((0, 0, 0))
+    assert_equal(segment_extent(segment.ids()), None)
+    segment.set_block(3, 7, 9, 1)
+    assert_equal(segment_extent(segment.ids()), (3, 7, 9, 3, 7, 9))
+    segment.set_block(31, 0, 30, 2047)
+    segment.set_block(0, 31, 10, 256)
+    assert_equal(segment_extent(segment.ids()), (0, 0, 9, 31, 31, 30))
+
+
+def test_verify_rebuild_header():
+    os.makedirs('test_blueprint/DATA')
+    segments = {}
+    for i, position in enumerate([(0, 0, 0), (32, 0, 0), (-32, 64, 0)]):
+        segment = Segment(position)
+        for j in range(200):
+            segment.set_block((j * 7 + i) % 32, (j * 3) % 32, (j * 11) % 32, 1 + (j + i) % 300)
+        segments[i] = segment
+    segments[3] = Segment((0, 0, 32))
+    SegmentFile.to_file('test_blueprint/DATA/test.0.0.0.smd2', segments)
+
+    expected = Counter()
+    corners = []
+    for segment in segments.values():
+        for x in range(32):
+            for y in range(32):
+                for z in range(32):
+                    id = segment.block(x, y, z).id
+                    if id:
+                        expected[id] += 1
+                        corners.append(tuple(p + c for p, c in zip(segment.position,
+                                                                    (x, y, z))))
+    box = tuple(min(c[i] for c in corners) for i in range(3)) + \
+        tuple(max(c[i] for c in corners) + 1 for i in range(3))
+
+    a, b = sorted(expected)[:2]
+    stale = dict(expected)
+    stale[a] += 5
+    del stale[b]
+    stale[999] = 1
+    Header(2, EntityTypes.ship, *(box + (stale,))).to_file('test_blueprint/header.smbph')
+    try:
+        for workers in [1, 4]:
+            diff = verify_header('test_blueprint', workers)
+            assert_equal(diff.elements, {a: (stale[a], expected[a]), b: (0, expected[b]),
+                                         999: (1, 0)})
+            assert_equal(diff.bounding_box, None)
+
+        diff = rebuild_header('test_blueprint')
+        assert_equal(len(diff.elements), 3)
+        header = Header.from_file('test_blueprint/header.smbph')
+        assert_equal(header.elements, dict(expected))
+        assert_equal(header.version, 2)
+        assert_equal(verify_header('test_blueprint'), ({}, None))
+
+        # a float box within half a block matches
+        header.xmin += 0.25
+        header.to_file('test_blueprint/header.smbph')
+        assert_equal(verify_header('test_blueprint'), ({}, None))
+
+        # a different box is reported, but not rewritten
+        header.xmax += 10
+        header.to_file('test_blueprint/header.smbph')
+        diff = verify_header('test_blueprint')
+        assert_equal(diff.bounding_box[1], box)
+        assert_equal(rebuild_header('test_blueprint'), diff)
+        assert_equal(Header.from_file('test_blueprint/header.smbph').xmax, header.xmax)
+    finally:
+        shutil.rmtree('test_blueprint')
@@ -0,0 +1,86 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import struct
+
+from nose.tools import assert_equal
+
+from devtools.blueprint_files import EntityTypes, Header
+from devtools.histogram import ElementHistogram, numpy
+
+
+def backends():
+    """Keyword arguments for each available backend."""
+    result = [dict(use_numpy=False), dict(use_numpy=False, dense=True)]
+    if numpy is not None:
+        result.append(dict(use_numpy=True))
+    return result
+
+
+def test_histogram_mapping():
+    for backend in backends():
+        h = ElementHistogram({7: 800, 13: 900, 3: 42}, **backend)
+        assert_equal(list(h), [3, 7, 13])
+        assert_equal(len(h), 3)
+        assert_equal(h[7], 800)
+        assert_equal(h[5], 0)
+        assert_equal(h[5000], 0)
+        assert 13 in h and 5 not in h
+        assert_equal(h.items(), [(3, 42), (7, 800), (13, 900)])
+        assert_equal(h.total(), 1742)
+        assert_equal(h, {7: 800, 13: 900, 3: 42, 99: 0})
+        h[2000] = 1
+        assert_equal(h.to_dict(), {3: 42, 7: 800, 13: 900, 2000: 1})
+        h[3] = 0
+        assert_equal(list(h), [7, 13, 2000])
+        assert_equal(eval(repr(h)), h)
+
+
+def test_histogram_arithmetic():
+    for backend, other in zip(backends(), reversed(backends())):
+        a = ElementHistogram({1: 10, 16: 5}, **backend)
+        b = ElementHistogram({16: 5, 300: 2}, **other)
+        assert_equal(a + b, {1: 10, 16: 10, 300: 2})
+        assert_equal(a - b, {1: 10, 300: -2})
+        assert_equal(a * 3, {1: 30, 16: 15})
+        assert_equal(2 * a, {1: 20, 16: 10})
+        assert_equal(a, {1: 10, 16: 5})
+        a += {2: 1}
+        assert_equal(a, {1: 10, 2: 1, 16: 5})
+        fleet = ElementHistogram.sum([a, b, {1: 1}], **backend)
+        assert_equal(fleet, {1: 11, 2: 1, 16: 10, 300: 2})
+
+
+def test_histogram_from_records():
+    data = struct.pack('>HIHI', 16, 100, 1, 1)
+    for backend in backends():
+        assert_equal(ElementHistogram.from_records(data, **backend), {1: 1, 16: 100})
+        assert_equal(len(ElementHistogram.from_records(b'', **backend)), 0)
+
+
+def test_header_histogram():
+    original = Header(1, EntityTypes.ship, -1, -2, -3, 4, 5, 6, {7: 800, 13: 900, 3: 42})
+    original.to_file('test.smbph')
+    for buffered in [False, True]:
+        header = Header.from_file('test.smbph', buffered=buffered, histogram=True)
+        assert isinstance(header.elements, ElementHistogram)
+        assert_equal(header.elements, original.elements)
+    header.to_file('test.smbph')
+    assert_equal(Header.from_file('test.smbph').elements, original.elements)
+    os.remove('test.smbph')
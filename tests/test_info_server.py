@@ -0,0 +1,88 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from devtools.blueprint_files import EntityTypes, Header, Meta, MetaDockedEntry, TagRoot
+from devtools.info_client import InfoClient
+from devtools.info_server import InfoServer
+
+
+def test_info_server():
+    config = os.path.join('test_starmade', 'data', 'config')
+    os.makedirs(config)
+    shutil.copy('tests/BlockTypes.properties', config)
+    shutil.copy('tests/BlockConfig.xml', config)
+    os.makedirs('test_starmade/ship/ATTACHED_0')
+    turret = MetaDockedEntry('ATTACHED_0', [0, 5, 0], [1.0, 1.0, 1.0], 0, 0)
+    for path, elements, docked in [('test_starmade/ship', {1: 1, 16: 10}, [turret]),
+                                   ('test_starmade/ship/ATTACHED_0', {6: 2, 999: 1}, [])]:
+        Header(2, EntityTypes.ship, -1, -1, -1, 1, 1, 1, elements).to_file(
+            os.path.join(path, 'header.smbph'))
+        Meta(0, docked, TagRoot()).to_file(os.path.join(path, 'meta.smbpm'))
+
+    server = InfoServer('test_info.sock', 'test_starmade')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with InfoClient('test_info.sock') as client:
+            assert_equal(client.request('ping'), 'pong')
+            header = client.request('header', path='test_starmade/ship')
+            assert_equal(header['type'], 'ship')
+            assert_equal(header['elements'], [[1, 1, 'Ship Core'], [16, 10, 'Cannon Barrel']])
+            assert_true(header['named'])
+
+            start = time.perf_counter()
+            for _ in range(100):
+                client.request('header', path='test_starmade/ship')
+            assert_true(time.perf_counter() - start < 5)
+
+            meta = client.request('meta', path='test_starmade/ship')
+            assert_equal([d['name'] for d in meta['docked']], ['ATTACHED_0'])
+            inventory = client.request('inventory', path='test_starmade/ship')
+            assert_equal(inventory['entities'], 2)
+            assert_equal(inventory['bounding_box'], [-1, -1, -1, 1, 6, 1])
+            assert_equal(inventory['elements'], [[1, 1, 'Ship Core'], [6, 2, 'Cannon Computer'],
+                                                 [16, 10, 'Cannon Barrel'], [999, 1, None]])
+            assert_raises(RuntimeError, client.request, 'header', path='nothing')
+            assert_raises(RuntimeError, client.request, 'nothing')
+            assert_equal(server.config.loads, 1)
+
+            with open(os.path.join(config, 'BlockTypes.properties'), 'a') as file:
+                file.write('\nTEST_ID=999\n')
+            os.utime(os.path.join(config, 'BlockTypes.properties'),
+                     ns=(0, time.time_ns() + 10 ** 9))
+            with open(os.path.join(config, 'BlockConfig.xml')) as file:
+                xml = file.read()
+            xml = xml.replace('<Block ', '<Block type="TEST_ID" name="Test" /><Block ', 1)
+            with open(os.path.join(config, 'BlockConfig.xml'), 'w') as file:
+                file.write(xml)
+            inventory = client.request('inventory', path='test_starmade/ship')
+            assert_equal(inventory['elements'][-1], [999, 1, 'Test'])
+            assert_equal(server.config.loads, 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree('test_starmade')
+    assert_true(not os.path.exists('test_info.sock'))
@@ -0,0 +1,53 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import shutil
+
+from nose.tools import assert_equal
+
+from devtools.blueprint_files import Header, Meta, load_segments
+from devtools.synthetic import count_tags, synthetic_header, synthetic_meta
+from devtools.synthetic import synthetic_station
+
+
+def test_synthetic_header():
+    header = synthetic_header(1000)
+    assert_equal(len(header.elements), 1000)
+    assert_equal(Header.from_buffer(header.to_bytes()).elements, header.elements)
+
+
+def test_synthetic_meta():
+    for compressed in [False, True]:
+        meta = synthetic_meta(depth=3, breadth=6, n_docked=5, bytearray_size=100,
+                              compressed=compressed)
+        assert_equal(len(meta.docked), 5)
+        data = meta.to_bytes()
+        reload = Meta.from_buffer(data)
+        assert_equal(count_tags(reload.tags.tag), count_tags(meta.tags.tag))
+        assert_equal(reload.to_bytes(), data)
+    assert_equal(meta.to_bytes(), synthetic_meta(depth=3, breadth=6, n_docked=5,
+                                                 bytearray_size=100,
+                                                 compressed=True).to_bytes())
+
+
+def test_synthetic_station():
+    synthetic_station('test_station', n_regions=2, n_segments=3)
+    try:
+        assert_equal(len(list(load_segments('test_station', workers=2))), 6)
+    finally:
+        shutil.rmtree('test_station')
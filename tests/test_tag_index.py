@@ -0,0 +1,142 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import io
+import os
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from devtools.blueprint_files import Meta, Payload, Tag, TagList, TagStruct, encode_tag
+from devtools.synthetic import synthetic_meta
+from devtools.tag_index import LazyTagStruct, TagIndex, open_meta
+
+
+def tag_bytes(tag):
+    data = io.BytesIO()
+    encode_tag(data, tag)
+    return data.getvalue()
+
+
+def test_tag_index():
+    for compressed in [False, True]:
+        meta = synthetic_meta(depth=3, breadth=5, n_docked=1, list_length=4,
+                              bytearray_size=20, compressed=compressed)
+        structs = Payload(12, TagList(13, [Payload(13, TagStruct([Tag('a', Payload(3, i))]))
+                                           for i in range(3)]))
+        lists = Payload(12, TagList(12, [Payload(12, TagList(8, [Payload(8, 'x')]))]))
+        meta.tags.tag.payload.data.tags += [Tag('structs', structs), Tag(None, lists)]
+        meta.to_file('test.smbpm')
+        try:
+            for buffered in [False, True]:
+                index = TagIndex()
+                meta = Meta.from_file('test.smbpm', buffered, index=index)
+                expected = tag_bytes(meta.tags.tag)
+                assert_equal(index.lengths[0], len(expected))
+                assert_equal(index.ends[0], len(index))
+
+                index.to_file('test.smbpi')
+                index = TagIndex.from_file('test.smbpi')
+                tag = index.open('test.smbpm')
+                assert_true(isinstance(tag.payload.data, LazyTagStruct))
+                assert_equal(tag_bytes(tag), expected)
+
+                source = tag.payload.data.source
+                for entry in index.children(0):
+                    data = source.stream.view[index.offsets[entry]:
+                                              index.offsets[entry] + index.lengths[entry]]
+                    assert_equal(tag_bytes(source.decode(entry)), bytes(data))
+        finally:
+            os.remove('test.smbpm')
+            os.remove('test.smbpi')
+
+
+def test_tag_index_out_of_date():
+    meta = synthetic_meta(depth=2, breadth=3)
+    meta.to_file('test.smbpm')
+    try:
+        index = TagIndex()
+        Meta.from_file('test.smbpm', index=index)
+        with open('test.smbpm', 'ab') as file:
+            file.write(b'\0')
+        assert_raises(ValueError, index.open, 'test.smbpm')
+    finally:
+        os.remove('test.smbpm')
+
+
+def test_open_meta():
+    for compressed in [False, True]:
+        meta = synthetic_meta(depth=4, breadth=5, n_docked=2, list_length=4,
+                              bytearray_size=20, compressed=compressed)
+        structs = Payload(12, TagList(13, [Payload(13, TagStruct([Tag('a', Payload(3, i))]))
+                                           for i in range(3)]))
+        meta.tags.tag.payload.data.tags.append(Tag('structs', structs))
+        meta.to_file('test.smbpm')
+        try:
+            with open('test.smbpm', 'rb') as file:
+                original = file.read()
+
+            copy = open_meta('test.smbpm')
+            if not compressed:
+                assert_equal(copy.to_bytes(), original)
+            root = copy.tags.tag.payload.data
+            assert_equal(len(list(root.pieces())), 1)
+            # decoding tags without changing them keeps the struct in one piece
+            for tag in root.tags:
+                if tag.payload.type == 13:
+                    tag.payload.data.tags
+            assert_equal(len(list(root.pieces())), 1)
+            if not compressed:
+                assert_equal(copy.to_bytes(), original)
+
+            def edit(meta):
+                tags = meta.tags.tag.payload.data.tags
+                tags[0].payload.data.tags[1].payload = Payload(8, 'changed')
+                tags[1].payload.data.list[2] = Payload(tags[1].payload.data.type,
+                                                       tags[1].payload.data.list[0].data)
+                tags[-1].payload.data.list[1].data.tags.append(Tag('b', Payload(8, 'new')))
+                del tags[2]
+                tags.insert(3, Tag('inserted', Payload(3, 42)))
+
+            expected = Meta.from_file('test.smbpm')
+            edit(expected)
+            edit(copy)
+            assert_true(len(list(copy.tags.tag.payload.data.pieces())) > 1)
+            assert_equal(tag_bytes(copy.tags.tag), tag_bytes(expected.tags.tag))
+            copy.to_file('test.smbpm')
+            assert_equal(tag_bytes(Meta.from_file('test.smbpm').tags.tag),
+                         tag_bytes(expected.tags.tag))
+        finally:
+            os.remove('test.smbpm')
+
+
+def test_open_meta_replace_tags():
+    meta = synthetic_meta(depth=3, breadth=3)
+    meta.to_file('test.smbpm')
+    try:
+        copy = open_meta('test.smbpm')
+        root = copy.tags.tag.payload.data
+        inner = [tag.payload.data for tag in root.tags if tag.payload.type == 13][0]
+        assert_true(isinstance(inner, LazyTagStruct))
+        # replace the tags of a struct that was never decoded
+        inner.tags = []
+        copy.to_file('test.smbpm')
+        root = Meta.from_file('test.smbpm').tags.tag.payload.data
+        inner = [tag.payload.data for tag in root.tags if tag.payload.type == 13][0]
+        assert_equal(inner.tags, [])
+    finally:
+        os.remove('test.smbpm')
@@ -0,0 +1,97 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import io
+import os
+
+from nose.tools import assert_equal, assert_true
+
+from devtools.blueprint_files import BinBufferParser, Meta, Payload, Tag, TagList
+from devtools.blueprint_files import TagRoot, TagStruct, encode_tag
+from devtools.synthetic import synthetic_meta
+from devtools.tag_query import TagQuery, lookup, skip_payload
+
+
+def all_paths(payload, steps=()):
+    yield steps
+    if payload.type == 13:
+        for i, tag in enumerate(payload.data.tags):
+            for path in all_paths(tag.payload, steps + (i,)):
+                yield path
+            if tag.name is not None:
+                yield steps + (tag.name,)
+    elif payload.type == 12:
+        for i, item in enumerate(payload.data.list):
+            for path in all_paths(item, steps + (i,)):
+                yield path
+
+
+def payload_bytes(payload):
+    data = io.BytesIO()
+    encode_tag(data, Tag(None, payload))
+    return data.getvalue()
+
+
+def test_tag_query():
+    for compressed in [False, True]:
+        meta = synthetic_meta(depth=3, breadth=5, n_docked=2, list_length=4,
+                              bytearray_size=20, compressed=compressed)
+        meta.to_file('test.smbpm')
+        try:
+            root = meta.tags.tag.payload
+            paths = list(all_paths(root))
+            missing = [('nothing',), (0, 'nothing'), (1, 99), (99,)]
+            for buffered in [False, True]:
+                for selection in [paths[::7], paths[3::5], paths[-3:], missing]:
+                    result = TagQuery(selection).from_file('test.smbpm', buffered)
+                    expected = {path: lookup(root, path) for path in selection}
+                    assert_equal(set(result), {path for path, payload in expected.items()
+                                               if payload is not None})
+                    for path, payload in result.items():
+                        assert_equal(payload_bytes(payload), payload_bytes(expected[path]))
+        finally:
+            os.remove('test.smbpm')
+
+
+def test_tag_query_stops_early():
+    tags = [Tag('first', Payload(3, 1)),
+            Tag('big', Payload(12, TagList(3, [Payload(3, i) for i in range(10000)]))),
+            Tag('nested', Payload(13, TagStruct([Tag('x', Payload(8, 'found'))]))),
+            Tag('last', Payload(3, 2))]
+    meta = Meta(0, [], TagRoot(0, Tag(None, Payload(13, TagStruct(tags)))))
+    data = meta.to_bytes()
+
+    stream = BinBufferParser(data)
+    result = TagQuery(['first']).from_meta(stream)
+    assert_equal(result['first'].data, 1)
+    assert_true(stream.tell() < 100)
+
+    stream = BinBufferParser(data)
+    result = TagQuery(['nested/x', ('big', 9999)]).from_meta(stream)
+    assert_equal(result['nested/x'].data, 'found')
+    assert_equal(result['big', 9999].data, 9999)
+    assert_true(stream.tell() < len(data) - 8)
+
+
+def test_skip_payload():
+    tag = synthetic_meta(depth=4, breadth=6, bytearray_size=10).tags.tag
+    data = payload_bytes(tag.payload) + b'\x07'
+    stream = BinBufferParser(data)
+    type = stream.get_one('b')
+    skip_payload(stream, abs(type))
+    assert_equal(stream.get_one('b'), 7)
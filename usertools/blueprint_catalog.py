@@ -0,0 +1,52 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+
+from devtools.catalog import CatalogTotals, scan_catalog
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Scan a directory of blueprints. '
+                                        'Writes one JSON record per blueprint '
+                                        'and a final summary record.',
+                            epilog="""pysmade  Copyright (C) 2015, Martin
+Billinger. This program comes with ABSOLUTELY NO WARRANTY; This is free
+software, and you are welcome to redistribute it under certain conditions; see
+the GNU General Public License for more details.""")
+    parser.add_argument('PATH_TO_BLUEPRINTS')
+    parser.add_argument('--meta', action='store_true', help='Also parse meta.smbpm')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--output', default=None, help='Output file (default: stdout)')
+    args = vars(parser.parse_args())
+
+    output = open(args['output'], 'w') if args['output'] else sys.stdout
+    totals = CatalogTotals()
+    for record in scan_catalog(args['PATH_TO_BLUEPRINTS'], meta=args['meta'],
+                               processes=args['processes']):
+        totals.add(record)
+        output.write(json.dumps(record, sort_keys=True) + '\n')
+    output.write(json.dumps({'summary': totals.to_dict()}, sort_keys=True) + '\n')
+    if output is not sys.stdout:
+        output.close()
+    if totals.errors:
+        print('{} of {} blueprints failed to parse'.format(
+            totals.errors, totals.errors + totals.blueprints), file=sys.stderr)
@@ -0,0 +1,94 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+from os import path
+from argparse import ArgumentParser
+
+from devtools.blueprint_index import BlueprintIndex
+from devtools.block_config import BlockConfig
+
+
+def element_condition(value, blocks):
+    """Parse 'BLOCK:COUNT', where BLOCK is a block id or, with --starmade,
+    a block name."""
+    block, count = value.rsplit(':', 1)
+    try:
+        block_id = int(block)
+    except ValueError:
+        if blocks is None:
+            raise SystemExit('Block names need --starmade: {}'.format(block))
+        block_id = blocks.ids_by_name[block]
+    return block_id, int(count)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Index blueprints in a database and query it',
+                            epilog="""pysmade  Copyright (C) 2015, Martin
+Billinger. This program comes with ABSOLUTELY NO WARRANTY; This is free
+software, and you are welcome to redistribute it under certain conditions; see
+the GNU General Public License for more details.""")
+    parser.add_argument('--db', dest='DATABASE', default='blueprints.sqlite',
+                        help='Index database file')
+    subparsers = parser.add_subparsers(dest='COMMAND')
+    build = subparsers.add_parser('build', help='Add or refresh all blueprints below a '
+                                                'directory, re-parsing only changed ones')
+    build.add_argument('PATH_TO_BLUEPRINTS')
+    build.add_argument('--processes', type=int, default=None)
+    query = subparsers.add_parser('query', help='List blueprints matching conditions')
+    query.add_argument('--type', help='Entity type, e.g. ship or station')
+    query.add_argument('--min', action='append', default=[], metavar='BLOCK:COUNT',
+                       help='Require at least COUNT blocks of BLOCK (repeatable)')
+    query.add_argument('--max', action='append', default=[], metavar='BLOCK:COUNT',
+                       help='Allow at most COUNT blocks of BLOCK (repeatable)')
+    query.add_argument('--max-size', type=float, help='Maximum bounding box extent')
+    query.add_argument('--min-docked', type=int)
+    query.add_argument('--max-docked', type=int)
+    query.add_argument('--starmade', dest='PATH_TO_STARMADE',
+                       help='Path to Starmade, to refer to blocks by name')
+    args = vars(parser.parse_args())
+
+    with BlueprintIndex(args['DATABASE']) as index:
+        if args['COMMAND'] == 'build':
+            delta = index.update(args['PATH_TO_BLUEPRINTS'], processes=args['processes'])
+            for status, paths in zip(['added', 'changed', 'removed'], delta):
+                for blueprint in paths:
+                    print('{:>8}: {}'.format(status, blueprint))
+            print('{} blueprints indexed'.format(len(index)))
+            for blueprint, error in index.errors():
+                print('failed: {} ({})'.format(blueprint, error))
+            for blueprint, error in index.meta_errors():
+                print('meta failed: {} ({})'.format(blueprint, error))
+        elif args['COMMAND'] == 'query':
+            blocks = None
+            if args['PATH_TO_STARMADE']:
+                blocks = BlockConfig(path.join(args['PATH_TO_STARMADE'],
+                                               'data/config/BlockTypes.properties'),
+                                     path.join(args['PATH_TO_STARMADE'],
+                                               'data/config/BlockConfig.xml'),
+                                     cachedir=path.join(path.expanduser('~'),
+                                                        '.cache', 'pysmade'))
+            for blueprint in index.query(
+                    type=args['type'],
+                    min_elements=dict(element_condition(v, blocks) for v in args['min']),
+                    max_elements=dict(element_condition(v, blocks) for v in args['max']),
+                    max_size=args['max_size'],
+                    min_docked=args['min_docked'],
+                    max_docked=args['max_docked']):
+                print(blueprint)
+        else:
+            parser.print_help()
@@ -23,8 +23,27 @@
 from os import path
 from argparse import ArgumentParser
 
-from devtools.blueprint_files import Header
-from devtools.block_config import BlockConfig
+# The parsers are imported where they are needed, so that --connect only
+# loads the client.
+from devtools.info_client import InfoClient
+
+
+def print_header(info, named):
+    print('\nHeader\n------')
+    print('    Version : {}'.format(info['version']))
+    print('Entity type : {}'.format(info['type']))
+    print('Bounding box: ({}, {}, {}) - ({}, {}, {})'.format(*info['bounding_box']))
+
+    if named:
+        print('     count Block ID')
+        for block_id, count, name in info['elements']:
+            print('{:>10} {}'.format(count, block_id if name is None else name))
+        print('({:>9} {})'.format(info['blocks'], 'Total'))
+    else:
+        print('Block ID   count')
+        for block_id, count, _ in info['elements']:
+            print('{:>8} : {}'.format(block_id, count))
+        print('   Total : {}'.format(info['blocks']))
 
 
 if __name__ == "__main__":
@@ -33,36 +52,65 @@ if __name__ == "__main__":
 Billinger. This program comes with ABSOLUTELY NO WARRANTY; This is free
 software, and you are welcome to redistribute it under certain conditions; see
 the GNU General Public License for more details.""")
-    parser.add_argument('PATH_TO_BLUEPRINT')
+    parser.add_argument('PATH_TO_BLUEPRINT', nargs='?')
     parser.add_argument('--starmade', dest='PATH_TO_STARMADE', help='Path to Starmade')
+    parser.add_argument('--cache-dir', dest='CACHE_DIR',
+                        default=path.join(path.expanduser('~'), '.cache', 'pysmade'),
+                        help='Where to cache the parsed Starmade block config')
+    parser.add_argument('--decode-stats', dest='DECODE_STATS', metavar='FOLDED_FILE',
+                        help='Profile decoding of meta.smbpm, print a table and '
+                             'write folded stacks for a flame graph to FOLDED_FILE')
+    parser.add_argument('--docked', dest='DOCKED', action='store_true',
+                        help='Include all docked entities in the block counts '
+                             'and the bounding box')
+    parser.add_argument('--serve', dest='SERVE', metavar='SOCKET',
+                        help='Keep the block config loaded and answer queries on '
+                             'the Unix socket SOCKET until interrupted')
+    parser.add_argument('--connect', dest='CONNECT', metavar='SOCKET',
+                        help='Ask the server on SOCKET instead of loading the '
+                             'block config')
     args = vars(parser.parse_args())
 
-    header = Header.from_file(path.join(args['PATH_TO_BLUEPRINT'],
-                                        'header.smbph'))
-    print(args['PATH_TO_BLUEPRINT'])
-    print('\nHeader\n------')
-    print('    Version : {}'.format(header.version))
-    print('Entity type : {}'.format(header.type.name))
-    print('Bounding box: ({}, {}, {}) - ({}, {}, {})'.format(header.xmin,
-                                                             header.ymin,
-                                                             header.zmin,
-                                                             header.xmax,
-                                                             header.ymax,
-                                                             header.zmax))
-
-    if args['PATH_TO_STARMADE']:
-        blocks = BlockConfig(path.join(args['PATH_TO_STARMADE'],
-                                       'data/config/BlockTypes.properties'),
-                             path.join(args['PATH_TO_STARMADE'],
-                                       'data/config/BlockConfig.xml')).blocks
-        print('     count Block ID')
-        for block_id in sorted(header.elements):
-            count = header.elements[block_id]
-            print('{:>10} {}'.format(count, blocks[block_id].name))
-        print('({:>9} {})'.format(sum(header.elements.values()), 'Total'))
+    if args['SERVE']:
+        from devtools.info_server import InfoServer
+        server = InfoServer(args['SERVE'], args['PATH_TO_STARMADE'], args['CACHE_DIR'])
+        print('Serving on {}'.format(args['SERVE']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        raise SystemExit()
+    if not args['PATH_TO_BLUEPRINT']:
+        parser.error('PATH_TO_BLUEPRINT is required')
+
+    blueprint = path.abspath(args['PATH_TO_BLUEPRINT'])
+    if args['CONNECT']:
+        with InfoClient(args['CONNECT']) as client:
+            info = client.request('header', path=blueprint)
+            if args['DOCKED']:
+                inventory = client.request('inventory', path=blueprint)
     else:
-        print('Block ID   count')
-        for block_id in sorted(header.elements):
-            count = header.elements[block_id]
-            print('{:>8} : {}'.format(block_id, count))
-        print('   Total : {}'.format(sum(header.elements.values())))
\ No newline at end of file
+        from devtools.info_server import WarmBlockConfig, header_info, inventory_info
+        config = WarmBlockConfig(args['PATH_TO_STARMADE'], args['CACHE_DIR']).get()
+        info = header_info(blueprint, config)
+        if args['DOCKED']:
+            inventory = inventory_info(blueprint, config)
+
+    print(args['PATH_TO_BLUEPRINT'])
+    if args['DOCKED']:
+        info.update(elements=inventory['elements'], blocks=inventory['blocks'],
+                    bounding_box=inventory['bounding_box'])
+        print('{} docked entities'.format(inventory['entities'] - 1))
+    print_header(info, info['named'])
+
+    if args['DECODE_STATS']:
+        from devtools.blueprint_files import Meta
+        from devtools.decode_stats import DecodeStats
+        stats = DecodeStats(stacks=True)
+        Meta.from_file(path.join(args['PATH_TO_BLUEPRINT'], 'meta.smbpm'), stats=stats)
+        print('\nMeta decoding\n-------------')
+        print(stats.report())
+        with open(args['DECODE_STATS'], 'w') as file:
+            stats.write_folded(file)
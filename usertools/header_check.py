@@ -0,0 +1,57 @@
+""" This file is part of pysmade.
+
+    pysmade is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    pysmade is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015, Martin Billinger
+"""
+
+from argparse import ArgumentParser
+
+from devtools.header_check import rebuild_header, verify_header
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Check the block counts and bounding box '
+                                        'of a blueprint header against its segments',
+                            epilog="""pysmade  Copyright (C) 2015, Martin
+Billinger. This program comes with ABSOLUTELY NO WARRANTY; This is free
+software, and you are welcome to redistribute it under certain conditions; see
+the GNU General Public License for more details.""")
+    parser.add_argument('PATH_TO_BLUEPRINT', nargs='+')
+    parser.add_argument('--fix', action='store_true',
+                        help='Rewrite the block counts of header.smbph if they differ; '
+                             'the bounding box is only reported')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of threads inflating segments')
+    args = parser.parse_args()
+
+    stale = 0
+    for blueprint in args.PATH_TO_BLUEPRINT:
+        check = rebuild_header if args.fix else verify_header
+        diff = check(blueprint, args.workers)
+        if not diff.elements and not diff.bounding_box:
+            print('{}: ok'.format(blueprint))
+            continue
+        if diff.elements:
+            stale += 1
+            print('{}: {}'.format(blueprint, 'rewritten' if args.fix else 'stale'))
+        else:
+            print('{}: counts ok'.format(blueprint))
+        for block_id, (stored, counted) in diff.elements.items():
+            print('{:>8} : {} stored, {} counted'.format(block_id, stored, counted))
+        if diff.bounding_box:
+            print('Bounding box differs (not rewritten): {} stored, {} computed'.format(
+                *diff.bounding_box))
+    if stale and not args.fix:
+        raise SystemExit(1)